@@ -1,14 +1,72 @@
 # src/ai_feedback.py
 import os
 import json
-from typing import Optional, List, Dict, Any
+import asyncio
+import hashlib
+import functools
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from .llm_cache import ExactCache, SemanticCache
+from .utils import count_tokens as _count_tokens, truncate_tokens as _truncate_tokens
+
+# orjson is a much faster encoder; stdlib json stays as the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-import openai
-from dotenv import load_dotenv
 
 # --- Setup ---
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Deployed environments inject the key directly; only read .env (local dev) when it is missing.
+if os.getenv("OPENAI_API_KEY") is None:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# One keep-alive pool per process: pays DNS + TCP + TLS once, then reuses (and multiplexes over HTTP/2).
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_HTTP_TIMEOUT = 30.0
+
+# The SDK retries only transient failures (connection errors, timeouts, 408/409/429/5xx) with jittered
+# exponential backoff (0.5s -> 8s) and honours Retry-After; 400/401/403/404 fail immediately.
+_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+# Model tiers: a fast, cheap default plus an opt-in premium tier (quality="high").
+_FEEDBACK_MODEL = os.getenv("OPENAI_FEEDBACK_MODEL", "gpt-4o-mini")
+_FLOW_MODEL = "gpt-4o-mini"
+_PREMIUM_MODEL = "gpt-4o"
+
+def _pick_model(default: str, model: Optional[str] = None, quality: str = "standard") -> str:
+    if model:
+        return model
+    return _PREMIUM_MODEL if quality == "high" else default
+
+_CLIENT: Optional[OpenAI] = None
+_ASYNC_CLIENT: Optional[AsyncOpenAI] = None
+
+def _client() -> OpenAI:
+    """Shared sync client, built on first use so a missing key only fails the call (and hits the fallback)."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.Client(limits=_HTTP_LIMITS, http2=True, timeout=_HTTP_TIMEOUT),
+            max_retries=_MAX_RETRIES,
+        )
+    return _CLIENT
+
+def _async_client() -> AsyncOpenAI:
+    """Async twin of _client() for the aget_* entrypoints."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        _ASYNC_CLIENT = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(limits=_HTTP_LIMITS, http2=True, timeout=_HTTP_TIMEOUT),
+            max_retries=_MAX_RETRIES,
+        )
+    return _ASYNC_CLIENT
 
 # ============================
 # System prompts (guardrails)
@@ -42,7 +100,7 @@ Output style
 - At least 1–2 short paragraphs for reflection, but give feedback in proportion to the quantity of writing.
 - Then at least 2–5 bullet micro‑suggestions (again, in proportion to the length of the writing, keep these ≤ ~12 words each), each grounded in a quoted fragment.
 - If the piece is already strong for their usual style, say so and keep notes minimal.
-"""
+""".strip()
 
 _FLOWSTATE_SYSTEM = """
 You are a reflective writing companion in FlowState practice mode.
@@ -52,7 +110,36 @@ Constraints:
 - Recognize one concrete improvement trend if present (based on context pack/goals).
 - Offer exactly ONE micro‑nudge aligned to the user’s selected goal(s).
 - Keep tone warm, brisk, and direct. No lists, no emojis.
-"""
+""".strip()
+
+# Built once and shared by reference across every request
+_SYS_COMPANION_MSG = {"role": "system", "content": _COMPANION_SYSTEM}
+_SYS_FLOW_MSG = {"role": "system", "content": _FLOWSTATE_SYSTEM}
+
+# OpenAI caches prompt prefixes server-side; a stable prompt_cache_key routes requests that share
+# the system prompt + task preamble to the same cache, so that prefix is not prefilled again.
+# Bump the suffix whenever the prompts above change.
+_COMPANION_CACHE_ROUTING = {"prompt_cache_key": "underwriter-companion-v1"}
+_FLOW_CACHE_ROUTING = {"prompt_cache_key": "underwriter-flow-v1"}
+
+# Constant task preambles; these lead the user message so every request shares a byte-identical prefix.
+_COMPANION_TASK = (
+    "Task: Provide a short reflection and a few micro‑suggestions.\n"
+    "- Compare to the user's own baseline when relevant (from Context Pack/anchors).\n"
+    "- Keep suggestions micro (tiny edits only), each grounded in a brief quote.\n"
+    "- Do NOT rewrite or generate content for the user.\n\n"
+)
+
+_FLOW_TASK = "Respond with ≤3 short sentences, honoring the constraints.\n\n"
+
+_BATCH_TASK = (
+    "You will receive several independent pieces of writing, each from a different user, as a JSON list.\n"
+    "Treat every item in isolation and apply all of the rules above to each one.\n"
+    "For each item: a short reflection plus a few micro‑suggestions, compared to that user's own baseline "
+    "(context/anchors) when relevant. Do NOT rewrite or generate content for any user.\n"
+    'Return JSON only: {"reflections": [{"id": <item id>, "reflection": "<text>"}, ...]} '
+    "with exactly one entry per input id.\n\n"
+)
 
 # ============================
 # Helpers
@@ -64,12 +151,24 @@ def _truncate(s: str, max_chars: int) -> str:
     s = s.strip()
     return s if len(s) <= max_chars else s[:max_chars] + "…"
 
+def _dumps(obj: Any) -> str:
+    """Compact JSON with sorted keys (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True)
+
+def _loads(raw: str) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
 def _safe_json(obj: Any, max_chars: int = 2000) -> str:
     """
     Stringify JSON safely and cap length to avoid blowing prompt budget.
+    Keys are sorted so unchanged sub-fields serialize byte-identically across calls.
     """
+    if obj is None or (isinstance(obj, (dict, list)) and not obj):
+        return "{}"
     try:
-        j = json.dumps(obj or {}, ensure_ascii=False)
+        j = _dumps(obj)
     except Exception:
         j = "{}"
     return _truncate(j, max_chars)
@@ -79,105 +178,554 @@ def _format_personal_anchors(anchors: Optional[List[Dict[str, Any]]], max_each:
     anchors: list like [{"id": "...", "title": "...", "excerpt": "..."}]
     Returns a compact string for the prompt.
     """
+    key = tuple(
+        (str(a.get("id")), a.get("title"), a.get("excerpt") or "")
+        for a in (anchors or [])[:k]
+        if a
+    )
+    return _format_anchors_cached(key, max_each)
+
+@functools.lru_cache(maxsize=256)
+def _format_anchors_cached(anchors: Tuple[Tuple[str, Optional[str], str], ...], max_each: int) -> str:
+    """Memoized on the normalized anchors: a user's session re-sends the same ones, byte for byte."""
     if not anchors:
         return "[]"
-    pruned = []
-    for a in anchors[:k]:
-        pruned.append({
-            "id": a.get("id"),
-            "title": a.get("title"),
-            "excerpt": _truncate(a.get("excerpt") or "", max_each),
-        })
+    pruned = [{"id": i, "title": t, "excerpt": _truncate(e, max_each)} for i, t, e in anchors]
     return _safe_json(pruned, max_chars=1600)
 
+# Context Pack sections, most stable first: the style profile and goals rarely change within a
+# session, samples change on save, counts and metrics on every submit. Each section is serialized
+# and capped on its own so a change in one field leaves the bytes of earlier sections (and the
+# provider's cached prefix) intact.
+_CONTEXT_SECTIONS = (
+    ("style_profile", "Style profile", 600),
+    ("active_goals", "Active goals", 200),
+    ("recent_samples", "Recent samples", 900),
+    ("overview", "Overview (counts/streak)", 300),
+    ("flow_metrics_recent", "Recent FlowState metrics", 500),
+)
+
+def _context_sections(context_pack: Optional[Dict[str, Any]]) -> str:
+    """Render the Context Pack as labeled JSON sections in a fixed order."""
+    ctx = context_pack or {}
+    return "".join(
+        f"[{label}]\n{_safe_json(ctx.get(key), max_chars=cap)}\n\n"
+        for key, label, cap in _CONTEXT_SECTIONS
+    )
+
+# ============================
+# Message builders
+# ============================
+
+# User-message templates, compiled once. Order matters for provider prefix caching: constant
+# text first, then per-user blocks from most to least stable, and the volatile draft last.
+_COMPANION_USER_TEMPLATE = (
+    _COMPANION_TASK
+    + "User style summary (if any): {style}\n\n"
+    "User Context Pack:\n{ctx}"
+    "Personal anchors (prior excerpts to calibrate feedback):\n{anchors}\n\n"
+    "Current writing:\n---\n{text}\n---"
+).format_map
+
+_FLOW_USER_TEMPLATE = (
+    _FLOW_TASK
+    + "Context (counts/goals): {ctx}\n"
+    "User goals: {goals}\n"
+    "Recent trend summary: {trends}\n"
+    "User's FlowState attempt:\n"
+    "---\n{text}\n---"
+).format_map
+
+def _companion_user_msg(
+    text: str,
+    profile_summary: str,
+    context_pack: Optional[Dict[str, Any]],
+    personal_anchors: Optional[List[Dict[str, Any]]],
+) -> str:
+    return _COMPANION_USER_TEMPLATE({
+        "style": profile_summary or "learning user style",
+        "ctx": _context_sections(context_pack),
+        "anchors": _format_personal_anchors(personal_anchors, max_each=360, k=3),
+        "text": _truncate_tokens(text, 1500),
+    })
+
+def _flow_user_msg(
+    text: str,
+    goals: List[str],
+    last_trends: str,
+    context_pack: Optional[Dict[str, Any]],
+) -> str:
+    ctx = context_pack or {}
+    view = {"active_goals": ctx.get("active_goals"), "overview": ctx.get("overview")}
+    # prompt / recent attempts come from db.flow_feedback_context; only sent when the caller has them
+    extra = {k: ctx[k] for k in ("prompt", "recent_attempts") if ctx.get(k)}
+    return _FLOW_USER_TEMPLATE({
+        "ctx": _safe_json({**view, **extra}, max_chars=1000 if extra else 600),
+        "goals": ", ".join(goals) if goals else "none",
+        "trends": last_trends or "none",
+        "text": _truncate_tokens(text, 750),
+    })
+
+# Prompt budget for companion requests; past the ceiling the oldest recent samples are dropped first.
+_PROMPT_TOKEN_CEILING = int(os.getenv("FEEDBACK_PROMPT_TOKEN_CEILING", "2500"))
+_COMPANION_MAX_TOKENS = 380
+
+def _fit_companion_user_msg(
+    text: str,
+    profile_summary: str,
+    context_pack: Optional[Dict[str, Any]],
+    personal_anchors: Optional[List[Dict[str, Any]]],
+) -> Tuple[str, int]:
+    """Build the companion user message within _PROMPT_TOKEN_CEILING; returns (message, prompt tokens)."""
+    msg = _companion_user_msg(text, profile_summary, context_pack, personal_anchors)
+    n = _count_tokens(msg)
+    samples = list((context_pack or {}).get("recent_samples") or [])
+    while n > _PROMPT_TOKEN_CEILING and samples:
+        samples.pop()  # newest first, so this drops the oldest
+        context_pack = {**context_pack, "recent_samples": samples}
+        msg = _companion_user_msg(text, profile_summary, context_pack, personal_anchors)
+        n = _count_tokens(msg)
+    return msg, n
+
+def _companion_request(
+    text: str,
+    profile_summary: str,
+    context_pack: Optional[Dict[str, Any]],
+    personal_anchors: Optional[List[Dict[str, Any]]],
+    model: str = _FEEDBACK_MODEL,
+) -> Dict[str, Any]:
+    """Full chat.completions kwargs for a companion reflection (shared by the sync and async paths)."""
+    user_msg, _ = _fit_companion_user_msg(text, profile_summary, context_pack, personal_anchors)
+    return {
+        "model": model,
+        "messages": [_SYS_COMPANION_MSG, {"role": "user", "content": user_msg}],
+        "temperature": 0.5,
+        "max_tokens": _COMPANION_MAX_TOKENS,
+    }
+
+def _flow_request(
+    text: str,
+    goals: List[str],
+    last_trends: str,
+    context_pack: Optional[Dict[str, Any]],
+    model: str = _FLOW_MODEL,
+) -> Dict[str, Any]:
+    """Full chat.completions kwargs for FlowState micro-feedback."""
+    return {
+        "model": model,
+        "messages": [
+            _SYS_FLOW_MSG,
+            {"role": "user", "content": _flow_user_msg(text, goals, last_trends, context_pack)},
+        ],
+        "temperature": 0.4,
+        "max_tokens": 120,
+    }
+
+def _companion_fallback(e: Exception) -> str:
+    return f"(Fallback) Reflection unavailable: {e}. One nudge: read once out loud and trim any filler."
+
+# Minimal non-LLM fallback
+_FLOW_FALLBACK = "Nice burst. Keep momentum—state one idea plainly, then add one vivid image."
+
+# ============================
+# Semantic response cache
+# ============================
+
+_EMBED_MODEL = "text-embedding-3-small"
+
+# Embeddings only feed the cache, so they fail fast instead of retrying: a miss just calls through.
+def _embed(text: str) -> List[float]:
+    return _client().with_options(max_retries=0).embeddings.create(model=_EMBED_MODEL, input=text[:8000]).data[0].embedding
+
+# Concurrent async lookups (agather_feedback, many users) are coalesced over a short window into one
+# embeddings.create(input=[...]) call; the endpoint takes lists natively.
+_EMBED_WINDOW = 0.02
+_EMBED_MAX_BATCH = 256
+_EMBED_PENDING: Dict[asyncio.AbstractEventLoop, List[Tuple[str, asyncio.Future]]] = {}
+
+async def _flush_embeds(batch: List[Tuple[str, asyncio.Future]]) -> None:
+    try:
+        resp = await _async_client().with_options(max_retries=0).embeddings.create(
+            model=_EMBED_MODEL, input=[t for t, _ in batch]
+        )
+        vecs = [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+    except Exception as e:
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_exception(e)
+        return
+    for (_, fut), vec in zip(batch, vecs):
+        if not fut.done():
+            fut.set_result(vec)
+
+def _flush_pending_embeds(loop: asyncio.AbstractEventLoop) -> None:
+    batch = _EMBED_PENDING.pop(loop, None)
+    if batch:
+        loop.create_task(_flush_embeds(batch))
+
+async def _aembed(text: str) -> List[float]:
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    batch = _EMBED_PENDING.get(loop)
+    if batch is None:
+        batch = _EMBED_PENDING[loop] = []
+        loop.call_later(_EMBED_WINDOW, _flush_pending_embeds, loop)
+    batch.append((text[:8000] or " ", fut))  # an empty input would fail the whole batch
+    if len(batch) >= _EMBED_MAX_BATCH:
+        _flush_pending_embeds(loop)
+    return await fut
+
+# Users iterate on near-identical drafts; a ~50ms embedding lookup beats a multi-second completion.
+_SEMANTIC_CACHE = SemanticCache(embed=_embed, aembed=_aembed, threshold=0.93, ttl=3600)
+
+# A near-duplicate draft may only reuse a reply written for the same surrounding prompt: every input
+# except the draft itself goes into the partition, so a different context pack, prompt, recent
+# attempts, trends or anchors is a miss rather than a reflection quoting context the user didn't send.
+def _inputs_digest(*parts: Any) -> bytes:
+    try:
+        raw = _dumps(parts)
+    except Exception:
+        raw = repr(parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+
+def _companion_partition(args: Dict[str, Any]) -> tuple:
+    return ("companion", args.get("model"), _inputs_digest(
+        args.get("profile_summary") or "", args.get("context_pack"), args.get("personal_anchors"),
+    ))
+
+def _flow_partition(args: Dict[str, Any]) -> tuple:
+    return ("flow", args.get("model"), _inputs_digest(
+        sorted(args.get("goals") or []), args.get("last_trends") or "", args.get("context_pack"),
+    ))
+
+# Exact repeats (re-submits, reruns) are answered before the semantic cache even embeds the text.
+_EXACT_CACHE = ExactCache(maxsize=2048, ttl=1800)
+
+def _exact_key(kind: str):
+    def key(args: Dict[str, Any]) -> Optional[bytes]:
+        try:
+            raw = _dumps({"kind": kind, **args})
+        except Exception:
+            return None  # unserializable context: skip the exact cache
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+    return key
+
+# Raw completions: raise on failure so errors (and fallback text) never land in the cache.
+@_EXACT_CACHE.wrap(key=_exact_key("companion"))
+@_SEMANTIC_CACHE.wrap(partition=_companion_partition)
+def _companion_completion(text, profile_summary, context_pack, personal_anchors, model) -> str:
+    resp = _client().chat.completions.create(
+        **_companion_request(text, profile_summary, context_pack, personal_anchors, model),
+        extra_body=_COMPANION_CACHE_ROUTING,
+    )
+    return resp.choices[0].message.content.strip()
+
+@_EXACT_CACHE.wrap(key=_exact_key("companion"))
+@_SEMANTIC_CACHE.wrap(partition=_companion_partition)
+async def _acompanion_completion(text, profile_summary, context_pack, personal_anchors, model) -> str:
+    resp = await _async_client().chat.completions.create(
+        **_companion_request(text, profile_summary, context_pack, personal_anchors, model),
+        extra_body=_COMPANION_CACHE_ROUTING,
+    )
+    return resp.choices[0].message.content.strip()
+
+@_EXACT_CACHE.wrap(key=_exact_key("flow"))
+@_SEMANTIC_CACHE.wrap(partition=_flow_partition)
+def _flow_completion(text, goals, last_trends, context_pack, model) -> str:
+    resp = _client().chat.completions.create(
+        **_flow_request(text, goals, last_trends, context_pack, model), extra_body=_FLOW_CACHE_ROUTING
+    )
+    return resp.choices[0].message.content.strip()
+
+@_EXACT_CACHE.wrap(key=_exact_key("flow"))
+@_SEMANTIC_CACHE.wrap(partition=_flow_partition)
+async def _aflow_completion(text, goals, last_trends, context_pack, model) -> str:
+    resp = await _async_client().chat.completions.create(
+        **_flow_request(text, goals, last_trends, context_pack, model), extra_body=_FLOW_CACHE_ROUTING
+    )
+    return resp.choices[0].message.content.strip()
+
 # ============================
 # Public API
 # ============================
 
-def get_ai_feedback(
+async def aget_ai_feedback(
     text: str,
     profile_summary: str = "",
     context_pack: Optional[Dict[str, Any]] = None,
     personal_anchors: Optional[List[Dict[str, Any]]] = None,
+    model: Optional[str] = None,
+    quality: str = "standard",
 ) -> str:
     """
     Standard companion reflection (not FlowState).
     Returns a short reflection + micro‑suggestions, with personalization.
     - context_pack: {"overview": {...}, "style_profile": {...}, "recent_samples": [...], "flow_metrics_recent": [...], "active_goals": [...]}
     - personal_anchors: list of the user's own past excerpts to serve as style anchors
+    - model / quality: explicit model override, or quality="high" for the premium tier
+      (default: $OPENAI_FEEDBACK_MODEL, else gpt-4o-mini)
     """
-    ctx_json = _safe_json(context_pack, max_chars=1800)
-    anchors_json = _format_personal_anchors(personal_anchors, max_each=360, k=3)
-
-    user_msg = (
-        f"User Context Pack (counts/streak/traits/goals/excerpts):\n{ctx_json}\n\n"
-        f"User style summary (if any): {profile_summary or 'learning user style'}\n\n"
-        f"Personal anchors (prior excerpts to calibrate feedback):\n{anchors_json}\n\n"
-        "Current writing:\n---\n" + _truncate(text, 6000) + "\n---\n\n"
-        "Task: Provide a short reflection and a few micro‑suggestions.\n"
-        "- Compare to the user's own baseline when relevant (from Context Pack/anchors).\n"
-        "- Keep suggestions micro (tiny edits only), each grounded in a brief quote.\n"
-        "- Do NOT rewrite or generate content for the user."
-    )
-
+    chosen = _pick_model(_FEEDBACK_MODEL, model, quality)
     try:
-        resp = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": _COMPANION_SYSTEM},
-                {"role": "user", "content": user_msg},
-            ],
-            temperature=0.5,
-            max_tokens=380,
-        )
-        return resp["choices"][0]["message"]["content"].strip()
+        return await _acompanion_completion(text, profile_summary, context_pack, personal_anchors, chosen)
     except Exception as e:
-        return f"(Fallback) Reflection unavailable: {e}. One nudge: read once out loud and trim any filler."
+        return _companion_fallback(e)
 
-def get_flow_feedback(
+async def aget_flow_feedback(
     text: str,
     goals: List[str],
     last_trends: str = "",
-    context_pack: Optional[Dict[str, Any]] = None
+    context_pack: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+    quality: str = "standard",
 ) -> str:
     """
     FlowState micro‑feedback: ≤3 sentences, one micro‑nudge aligned to active goals.
     - goals: e.g. ['playfulness','clarity']
     - last_trends: a compact string like 'Playfulness +0.07; Clarity -0.02'
     - context_pack: optional; used to recognize improvement trend or note consistency
+    - model / quality: as in aget_ai_feedback (default gpt-4o-mini)
     """
-    goals_str = ", ".join(goals) if goals else "none"
-    ctx_hint = _safe_json(
-        {
-            "active_goals": (context_pack or {}).get("active_goals"),
-            "overview": (context_pack or {}).get("overview"),
-        },
-        max_chars=600,
-    )
+    chosen = _pick_model(_FLOW_MODEL, model, quality)
+    try:
+        return await _aflow_completion(text, goals, last_trends, context_pack, chosen)
+    except Exception:
+        return _FLOW_FALLBACK
 
-    user_msg = (
-        f"User goals: {goals_str}\n"
-        f"Recent trend summary: {last_trends or 'none'}\n"
-        f"Context (counts/goals): {ctx_hint}\n"
-        "User's FlowState attempt:\n"
-        f"---\n{_truncate(text, 3000)}\n---\n"
-        "Respond now with ≤3 short sentences, honoring the constraints."
-    )
+async def agather_feedback(jobs: List[Dict[str, Any]], max_concurrency: int = 8) -> List[str]:
+    """
+    Fan out many companion/FlowState requests at once; results come back in job order.
+    - jobs: [{"kind": "companion" | "flow", **kwargs for aget_ai_feedback / aget_flow_feedback}, ...]
+    - max_concurrency: in-flight ceiling; size it to the account's RPM/TPM limits
+    """
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(job: Dict[str, Any]) -> str:
+        kwargs = dict(job)
+        kind = kwargs.pop("kind", "companion")
+        fn = aget_flow_feedback if kind == "flow" else aget_ai_feedback
+        async with sem:
+            return await fn(**kwargs)
+
+    return list(await asyncio.gather(*(_run(j) for j in jobs)))
+
+def get_ai_feedback(
+    text: str,
+    profile_summary: str = "",
+    context_pack: Optional[Dict[str, Any]] = None,
+    personal_anchors: Optional[List[Dict[str, Any]]] = None,
+    model: Optional[str] = None,
+    quality: str = "standard",
+) -> str:
+    """
+    Blocking twin of aget_ai_feedback for sync callers (Streamlit, CLI).
+    Uses the pooled sync client rather than asyncio.run, which would open a fresh loop (and pool) per call.
+    """
+    chosen = _pick_model(_FEEDBACK_MODEL, model, quality)
+    try:
+        return _companion_completion(text, profile_summary, context_pack, personal_anchors, chosen)
+    except Exception as e:
+        return _companion_fallback(e)
+
+def stream_ai_feedback(
+    text: str,
+    profile_summary: str,
+    context_pack: Optional[Dict[str, Any]] = None,
+    personal_anchors: Optional[List[Dict[str, Any]]] = None,
+    model: Optional[str] = None,
+    quality: str = "standard",
+) -> Iterator[str]:
+    """
+    Streaming twin of get_ai_feedback: yields reflection text as the tokens arrive.
+    Bypasses the semantic cache. If the request fails before any text is produced the
+    fallback is yielded instead; a failure mid-stream just ends the stream.
+    A completed reflection is kept in the exact cache, keyed by text, model and everything the
+    prompt carries about the writer (profile summary, context pack, anchors), and re-analyzing
+    the same text with the same context replays it in one piece without a request.
+    """
+    chosen = _pick_model(_FEEDBACK_MODEL, model, quality)
+    key = _exact_key("companion-stream")({
+        "text": text,
+        "profile_summary": profile_summary,
+        "context": _inputs_digest(context_pack, personal_anchors),
+        "model": chosen,
+    })
+    hit = _EXACT_CACHE.get(key)
+    if hit is not None:
+        yield hit
+        return
+    started = False
+    pieces: List[str] = []
+    try:
+        stream = _client().chat.completions.create(
+            **_companion_request(text, profile_summary, context_pack, personal_anchors, chosen),
+            extra_body=_COMPANION_CACHE_ROUTING,
+            stream=True,
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            piece = chunk.choices[0].delta.content
+            if piece:
+                started = True
+                pieces.append(piece)
+                yield piece
+    except Exception as e:
+        if not started:
+            yield _companion_fallback(e)
+        return
+    reflection = "".join(pieces).strip()
+    if reflection:
+        _EXACT_CACHE.set(key, reflection)
+
+def get_flow_feedback(
+    text: str,
+    goals: List[str],
+    last_trends: str = "",
+    context_pack: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+    quality: str = "standard",
+) -> str:
+    """Blocking twin of aget_flow_feedback for sync callers."""
+    chosen = _pick_model(_FLOW_MODEL, model, quality)
+    try:
+        return _flow_completion(text, goals, last_trends, context_pack, chosen)
+    except Exception:
+        return _FLOW_FALLBACK
+
+# Output cap of the feedback models; a batched call asks for max_tokens_each per item, so
+# larger batches are split into several calls that each stay under it.
+_MAX_OUTPUT_TOKENS = 16_384
 
+def _feedback_chunk(items: List[Dict[str, Any]], max_tokens_each: int, model: str) -> List[str]:
+    batch = [
+        {
+            "id": i,
+            "context_pack": _safe_json(it.get("context_pack"), max_chars=900),
+            "style_summary": it.get("profile_summary") or "learning user style",
+            "anchors": _format_personal_anchors(it.get("personal_anchors"), max_each=240, k=2),
+            "writing": _truncate_tokens(it.get("text") or "", 1000),
+        }
+        for i, it in enumerate(items, start=1)
+    ]
+
+    by_id: Dict[int, str] = {}
     try:
-        resp = openai.ChatCompletion.create(
-            model="gpt-4",
+        resp = _client().chat.completions.create(
+            model=model,
             messages=[
-                {"role": "system", "content": _FLOWSTATE_SYSTEM},
-                {"role": "user", "content": user_msg},
+                _SYS_COMPANION_MSG,
+                {"role": "user", "content": _BATCH_TASK + _dumps(batch)},
             ],
-            temperature=0.4,
-            max_tokens=120,
+            response_format={"type": "json_object"},
+            temperature=0.5,
+            max_tokens=max_tokens_each * len(items),
         )
-        return resp["choices"][0]["message"]["content"].strip()
-    except Exception:
-        # Minimal non-LLM fallback
-        return "Nice burst. Keep momentum—state one idea plainly, then add one vivid image."
+        data = _loads(resp.choices[0].message.content)
+        for r in data.get("reflections") or []:
+            if not isinstance(r, dict):
+                continue
+            # Models sometimes echo the id back as a string ("3")
+            try:
+                rid = int(r.get("id"))
+            except (TypeError, ValueError):
+                continue
+            by_id[rid] = (r.get("reflection") or "").strip()
+        err: Exception = ValueError("missing from batch response")
+    except Exception as e:
+        by_id, err = {}, e
+
+    return [by_id.get(i) or _companion_fallback(err) for i in range(1, len(items) + 1)]
+
+def get_ai_feedback_many(
+    items: List[Dict[str, Any]],
+    max_tokens_each: int = 380,
+    model: Optional[str] = None,
+    quality: str = "standard",
+) -> List[str]:
+    """
+    Companion reflections for several users in one chat completion per chunk (bulk jobs, digests).
+    The system prompt is billed once per chunk and each chunk costs one request against the RPM
+    limit; chunks are sized so their combined max_tokens stays under _MAX_OUTPUT_TOKENS.
+    - items: [{"text": ..., "profile_summary": ..., "context_pack": ..., "personal_anchors": ...}, ...]
+    Returns reflections in input order; any item the model drops or garbles gets the fallback text.
+    """
+    if not items:
+        return []
+    chosen = _pick_model(_FEEDBACK_MODEL, model, quality)
+    size = max(1, _MAX_OUTPUT_TOKENS // max(1, max_tokens_each))
+    out: List[str] = []
+    for start in range(0, len(items), size):
+        out.extend(_feedback_chunk(items[start:start + size], max_tokens_each, chosen))
+    return out
+
+# ============================
+# Batch API (non-urgent work)
+# ============================
+
+def submit_ai_feedback_batch(jobs: List[Dict[str, Any]]) -> str:
+    """
+    Queue companion reflections on the OpenAI Batch API (≈50% cheaper, separate rate-limit pool,
+    results within 24h). Use for digests/imports where nobody is waiting on the answer.
+    - jobs: [{"id": "<your job id>", "text": ..., "profile_summary": ..., "context_pack": ..., "personal_anchors": ...}, ...]
+    Returns the batch id to hand to poll_and_fetch().
+    """
+    lines = [
+        _dumps({
+            "custom_id": str(job["id"]),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _companion_request(
+                job.get("text") or "",
+                job.get("profile_summary") or "",
+                job.get("context_pack"),
+                job.get("personal_anchors"),
+            ),
+        })
+        for job in jobs
+    ]
+    client = _client()
+    upload = client.files.create(
+        file=("feedback_batch.jsonl", ("\n".join(lines) + "\n").encode("utf-8")),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=upload.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    return batch.id
+
+def poll_and_fetch(batch_id: str) -> Optional[Dict[str, str]]:
+    """
+    Check a submitted batch once.
+    Returns None while it is still running, else {job_id: reflection}; jobs that errored get the fallback text.
+    Raises RuntimeError if the batch failed, expired, or was cancelled.
+    """
+    client = _client()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status in ("failed", "expired", "cancelled"):
+        raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'")
+    if batch.status != "completed":
+        return None
+
+    out: Dict[str, str] = {}
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            rec = _loads(line)
+            try:
+                body = rec["response"]["body"]
+                out[rec["custom_id"]] = body["choices"][0]["message"]["content"].strip()
+            except Exception as e:
+                out[rec.get("custom_id")] = _companion_fallback(e)
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                rec = _loads(line)
+                out.setdefault(rec.get("custom_id"), _companion_fallback(RuntimeError(rec.get("error"))))
+    return out
 
 # ============================
 # (Optional) tiny convenience
@@ -1,12 +1,141 @@
 # src/ai_grader.py
 import os
 import json
-import openai
-from dotenv import load_dotenv
+import asyncio
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from .llm_cache import DiskCache
+from .utils import count_tokens, truncate_tokens
+
+# orjson is a much faster encoder/decoder for these schema + anchor payloads; stdlib json stays as the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = [
+    "extract_rubric_schema", "aextract_rubric_schema",
+    "extract_scored_sample", "aextract_scored_sample",
+    "grade_with_rubric", "agrade_with_rubric",
+    "grade_many", "agrade_many",
+]
 
 # --- Setup ---
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Deployed environments inject the key directly; only read .env (local dev) when it is missing.
+if os.getenv("OPENAI_API_KEY") is None:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# gpt-4o gets OpenAI's automatic prefix caching (≥1024-token shared prefix), unlike legacy gpt-4.
+_GRADER_MODEL = os.getenv("OPENAI_GRADER_MODEL", "gpt-4o")
+
+# Long JSON replies (up to 1200 tokens) from a large model: allow more time than the feedback path.
+_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=16, max_connections=32)
+_HTTP_TIMEOUT = 90.0
+
+# Rate limits and timeouts are retried by the SDK (jittered exponential backoff, Retry-After honoured)
+# before a fallback is returned; grading is not latency-critical, so allow more attempts than feedback.
+# 400/401 are never retried.
+_MAX_RETRIES = int(os.getenv("OPENAI_GRADER_MAX_RETRIES", "4"))
+
+_CLIENT: Optional[OpenAI] = None
+_ASYNC_CLIENT: Optional[AsyncOpenAI] = None
+
+def _client() -> OpenAI:
+    """Shared sync client, built on first use so a missing key only fails the call (and hits the fallback)."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.Client(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+            max_retries=_MAX_RETRIES,
+        )
+    return _CLIENT
+
+def _async_client() -> AsyncOpenAI:
+    """Async twin of _client() for the a* entrypoints."""
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        _ASYNC_CLIENT = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=httpx.AsyncClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT),
+            max_retries=_MAX_RETRIES,
+        )
+    return _ASYNC_CLIENT
+
+def _dumps(obj: Any) -> str:
+    """Compact JSON with sorted keys, so identical inputs serialize byte-identically (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True)
+
+def _loads(raw: str) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def _chat(messages: List[Dict[str, str]], on_delta: Optional[Callable[[str], None]] = None, **kw) -> str:
+    """One completion; with on_delta the reply is streamed and each text piece is handed over as it arrives."""
+    if on_delta is None:
+        resp = _client().chat.completions.create(model=_GRADER_MODEL, messages=messages, **kw)
+        return resp.choices[0].message.content.strip()
+    parts = []
+    for chunk in _client().chat.completions.create(model=_GRADER_MODEL, messages=messages, stream=True, **kw):
+        piece = chunk.choices[0].delta.content if chunk.choices else None
+        if piece:
+            parts.append(piece)
+            on_delta(piece)
+    return "".join(parts).strip()
+
+async def _achat(messages: List[Dict[str, str]], **kw) -> str:
+    resp = await _async_client().chat.completions.create(model=_GRADER_MODEL, messages=messages, **kw)
+    return resp.choices[0].message.content.strip()
+
+# Teachers re-upload the same rubric and re-grade the same essays while iterating; parsed results are
+# kept on disk for 30 days, keyed by the full request. Fallbacks are never stored.
+_RESULT_CACHE = DiskCache(os.getenv("GRADER_CACHE_PATH", "data/llm_cache.sqlite3"), ttl=30 * 86400)
+
+def _cache_key(messages: List[Dict[str, str]], kw: Dict[str, Any]) -> str:
+    payload = _dumps({"m": _GRADER_MODEL, "msgs": messages, "kw": kw})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cached_chat(messages: List[Dict[str, str]], parse, on_delta=None, **kw) -> dict:
+    """_chat + parse, served from / written to the result cache."""
+    key = _cache_key(messages, kw)
+    hit = _RESULT_CACHE.get(key)
+    if hit is not None:
+        return hit
+    data = parse(_chat(messages, on_delta=on_delta, **kw))
+    _RESULT_CACHE.set(key, data)
+    return data
+
+async def _acached_chat(messages: List[Dict[str, str]], parse, **kw) -> dict:
+    key = _cache_key(messages, kw)
+    hit = _RESULT_CACHE.get(key)
+    if hit is not None:
+        return hit
+    data = parse(await _achat(messages, **kw))
+    _RESULT_CACHE.set(key, data)
+    return data
+
+# Structured outputs (gpt-4o-2024-08-06+): the reply is constrained to the JSON schema, so a stray
+# backtick or prose preamble can no longer turn a paid call into a fallback.
+def _json_schema_format(name: str, schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+
+def _per_criterion_schema(rubric_schema: dict, value: dict) -> dict:
+    """Object with exactly one required key per rubric criterion."""
+    names = list(dict.fromkeys(c["name"] for c in rubric_schema.get("criteria", [])))
+    return {
+        "type": "object",
+        "properties": {n: value for n in names},
+        "required": names,
+        "additionalProperties": False,
+    }
 
 # -----------------------------
 # Rubric extraction from uploads
@@ -30,51 +159,104 @@ Output only JSON with this schema:
 """
 
 def _normalize_weights(criteria):
-    total = sum(float(c.get("weight", 0) or 0) for c in criteria) or 1.0
-    for c in criteria:
-        c["weight"] = round(float(c.get("weight", 0) or 0) / total, 4)
+    weights = [float(c.get("weight", 0) or 0) for c in criteria]  # parse each weight once
+    total = sum(weights) or 1.0
+    for c, w in zip(criteria, weights):
+        c["weight"] = round(w / total, 4)
     return criteria
 
-def extract_rubric_schema(rubric_text: str) -> dict:
-    """Extract a structured rubric schema (title/scale/criteria/weights/descriptors) from teacher text."""
+_LEVELS = ["4", "3", "2", "1", "0"]
+
+_RUBRIC_FORMAT = _json_schema_format("rubric", {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "scale": {"type": "string", "enum": ["0-4", "0-100"]},
+        "criteria": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "weight": {"type": "number"},
+                    "descriptor_levels": {
+                        "type": "object",
+                        "properties": {k: {"type": "string"} for k in _LEVELS},
+                        "required": _LEVELS,
+                        "additionalProperties": False,
+                    },
+                },
+                "required": ["name", "weight", "descriptor_levels"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["title", "scale", "criteria"],
+    "additionalProperties": False,
+})
+
+def _rubric_messages(rubric_text: str) -> List[Dict[str, str]]:
     user = (
         "Extract a rubric JSON from the following text. If the scale isn't explicit, prefer '0-4'.\n\n"
         f"RUBRIC TEXT:\n---\n{rubric_text}\n---"
     )
+    return [
+        {"role": "system", "content": _EXTRACT_SYSTEM},
+        {"role": "user", "content": user},
+    ]
+
+def _finish_rubric(raw: str) -> dict:
+    data = _loads(raw)
+    # normalize
+    data["criteria"] = _normalize_weights(data.get("criteria", []))
+    data["scale"] = (data.get("scale") or "0-4") if data.get("scale") in ("0-4", "0-100") else "0-4"
+    # ensure descriptor bands exist
+    for c in data["criteria"]:
+        d = c.get("descriptor_levels") or {}
+        for k in ["4","3","2","1","0"]:
+            d.setdefault(k, "")
+        c["descriptor_levels"] = d
+    return data
+
+def _fallback_rubric() -> dict:
+    # Fallback minimal schema if LLM fails
+    return {
+        "title": "Untitled Rubric",
+        "scale": "0-4",
+        "criteria": [
+            {"name": "Thesis", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
+            {"name": "Evidence", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
+            {"name": "Organization", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
+            {"name": "Style/Mechanics", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
+        ]
+    }
+
+def is_fallback_rubric(schema: dict) -> bool:
+    """True if extract_rubric_schema fell back to the placeholder rubric (callers should not cache it)."""
+    return schema == _fallback_rubric()
+
+def extract_rubric_schema(rubric_text: str, on_delta: Optional[Callable[[str], None]] = None) -> dict:
+    """
+    Extract a structured rubric schema (title/scale/criteria/weights/descriptors) from teacher text.
+    - on_delta: optional callback; streams the raw JSON reply piece by piece for live progress
+    """
     try:
-        resp = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": _EXTRACT_SYSTEM},
-                {"role": "user", "content": user},
-            ],
-            temperature=0.2,
-            max_tokens=1200,
+        return _cached_chat(
+            _rubric_messages(rubric_text), _finish_rubric, on_delta=on_delta,
+            temperature=0.2, max_tokens=1200, response_format=_RUBRIC_FORMAT,
         )
-        raw = resp["choices"][0]["message"]["content"].strip()
-        data = json.loads(raw)
-        # normalize
-        data["criteria"] = _normalize_weights(data.get("criteria", []))
-        data["scale"] = (data.get("scale") or "0-4") if data.get("scale") in ("0-4", "0-100") else "0-4"
-        # ensure descriptor bands exist
-        for c in data["criteria"]:
-            d = c.get("descriptor_levels") or {}
-            for k in ["4","3","2","1","0"]:
-                d.setdefault(k, "")
-            c["descriptor_levels"] = d
-        return data
-    except Exception as e:
-        # Fallback minimal schema if LLM fails
-        return {
-            "title": "Untitled Rubric",
-            "scale": "0-4",
-            "criteria": [
-                {"name": "Thesis", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
-                {"name": "Evidence", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
-                {"name": "Organization", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
-                {"name": "Style/Mechanics", "weight": 0.25, "descriptor_levels": {"4":"","3":"","2":"","1":"","0":""}},
-            ]
-        }
+    except Exception:
+        return _fallback_rubric()
+
+async def aextract_rubric_schema(rubric_text: str) -> dict:
+    """Async twin of extract_rubric_schema."""
+    try:
+        return await _acached_chat(
+            _rubric_messages(rubric_text), _finish_rubric,
+            temperature=0.2, max_tokens=1200, response_format=_RUBRIC_FORMAT,
+        )
+    except Exception:
+        return _fallback_rubric()
 
 # -----------------------------------------
 # Filled-rubric score extraction (no manual)
@@ -89,32 +271,64 @@ Output JSON only:
   "rationales": { "CriterionName": "short explanation", ... }
 }"""
 
+def _scored_sample_messages(graded_rubric_text: str, rubric_schema: dict) -> List[Dict[str, str]]:
+    # The schema is shared by every sample of a rubric, so it rides in the cacheable system prefix.
+    system = (
+        _EXTRACT_SCORES_SYSTEM +
+        "\n\nRUBRIC SCHEMA:\n" + _dumps(rubric_schema)
+    )
+    user = "FILLED/TEACHER-GRADED RUBRIC TEXT:\n---\n" + graded_rubric_text + "\n---"
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+def _scored_sample_format(rubric_schema: dict) -> dict:
+    return _json_schema_format("scored_sample", {
+        "type": "object",
+        "properties": {
+            "overall": {"type": ["number", "null"]},
+            "per_criterion": _per_criterion_schema(rubric_schema, {"type": ["number", "null"]}),
+            "rationales": _per_criterion_schema(rubric_schema, {"type": "string"}),
+        },
+        "required": ["overall", "per_criterion", "rationales"],
+        "additionalProperties": False,
+    })
+
+def _finish_scored_sample(raw: str, rubric_schema: dict) -> dict:
+    data = _loads(raw)
+    # Ensure schema criteria are present
+    rubric_criteria = [c["name"] for c in rubric_schema.get("criteria", [])]
+    pc = data.get("per_criterion", {}) or {}
+    for name in rubric_criteria:
+        pc.setdefault(name, None)
+    data["per_criterion"] = pc
+    return data
+
+def _scored_sample_fallback(e: Exception) -> dict:
+    return {"overall": None, "per_criterion": {}, "rationales": {"_note": f"Extraction failed: {e}"}}
+
 def extract_scored_sample(graded_rubric_text: str, rubric_schema: dict) -> dict:
     """Parse the filled rubric text into per-criterion scores aligned to rubric_schema."""
-    user = (
-        "RUBRIC SCHEMA:\n" + json.dumps(rubric_schema, ensure_ascii=False) +
-        "\n\nFILLED/TEACHER-GRADED RUBRIC TEXT:\n---\n" + graded_rubric_text + "\n---"
-    )
     try:
-        resp = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": _EXTRACT_SCORES_SYSTEM},
-                {"role": "user", "content": user},
-            ],
-            temperature=0.0,
-            max_tokens=900,
+        return _cached_chat(
+            _scored_sample_messages(graded_rubric_text, rubric_schema),
+            lambda raw: _finish_scored_sample(raw, rubric_schema),
+            temperature=0.0, max_tokens=900, response_format=_scored_sample_format(rubric_schema),
+        )
+    except Exception as e:
+        return _scored_sample_fallback(e)
+
+async def aextract_scored_sample(graded_rubric_text: str, rubric_schema: dict) -> dict:
+    """Async twin of extract_scored_sample."""
+    try:
+        return await _acached_chat(
+            _scored_sample_messages(graded_rubric_text, rubric_schema),
+            lambda raw: _finish_scored_sample(raw, rubric_schema),
+            temperature=0.0, max_tokens=900, response_format=_scored_sample_format(rubric_schema),
         )
-        data = json.loads(resp["choices"][0]["message"]["content"])
-        # Ensure schema criteria are present
-        rubric_criteria = [c["name"] for c in rubric_schema.get("criteria", [])]
-        pc = data.get("per_criterion", {}) or {}
-        for name in rubric_criteria:
-            pc.setdefault(name, None)
-        data["per_criterion"] = pc
-        return data
     except Exception as e:
-        return {"overall": None, "per_criterion": {}, "rationales": {"_note": f"Extraction failed: {e}"}}
+        return _scored_sample_fallback(e)
 
 # -----------------------------
 # Self-test grading (few-shot)
@@ -132,16 +346,24 @@ Output JSON only:
   "confidence": "low|medium|high"
 }"""
 
-def _format_anchors(anchors, max_chars=1400):
+@functools.lru_cache(maxsize=256)
+def _anchor_excerpt(text: str, max_tokens: int) -> tuple:
+    """(excerpt, token count) for one anchor; re-grading against the same anchors skips re-encoding."""
+    excerpt = truncate_tokens(text.replace("\n", " "), max_tokens, ellipsis="...")
+    return excerpt, count_tokens(excerpt)
+
+def _format_anchors(anchors, max_tokens_each=350, max_tokens_total=2000):
     """
     anchors: list of dicts with keys {"text", "overall", "per_criterion"}
-    We keep it compact; truncate text and include the numeric labels.
+    We keep it compact: each excerpt is capped by tokens, and anchors stop once the total budget is spent.
     """
     out = []
+    used = 0
     for a in anchors or []:
-        txt = (a.get("text") or "").strip().replace("\n", " ")
-        if len(txt) > max_chars:
-            txt = txt[:max_chars] + "..."
+        txt, n = _anchor_excerpt((a.get("text") or "").strip(), max_tokens_each)
+        if out and used + n > max_tokens_total:
+            break
+        used += n
         out.append({
             "text_excerpt": txt,
             "overall": a.get("overall"),
@@ -149,44 +371,109 @@ def _format_anchors(anchors, max_chars=1400):
         })
     return out
 
+def _grade_messages(essay_text: str, rubric_schema: dict, anchors: list, leniency: float) -> List[Dict[str, str]]:
+    # Everything shared across a class set (instructions, schema, anchors) forms one byte-stable
+    # system prefix that the provider caches; only the essay and leniency vary per call.
+    # Keep the first six anchors as given (the teacher's choice), then order just those for stability
+    stable = sorted((anchors or [])[:6], key=lambda a: str(a.get("id") or a.get("text") or ""))
+    system = (
+        _GRADE_SYSTEM +
+        "\n\nRUBRIC_SCHEMA:\n" + _dumps(rubric_schema) +
+        "\n\nANCHORS:\n" + _dumps(_format_anchors(stable))
+    )
+    user_payload = {"essay_text": essay_text, "leniency_hint": float(leniency)}
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": _dumps(user_payload)}
+    ]
+
+def _grade_format(rubric_schema: dict) -> dict:
+    return _json_schema_format("grade", {
+        "type": "object",
+        "properties": {
+            "overall": {"type": "number"},
+            "per_criterion": _per_criterion_schema(rubric_schema, {"type": "number"}),
+            "rationales": _per_criterion_schema(rubric_schema, {"type": "string"}),
+            "confidence": {"type": "string", "enum": ["low", "medium", "high"]},
+        },
+        "required": ["overall", "per_criterion", "rationales", "confidence"],
+        "additionalProperties": False,
+    })
+
+def _finish_grade(raw: str, rubric_schema: dict) -> dict:
+    data = _loads(raw)
+    # Ensure every criterion has a slot
+    crit_names = [c["name"] for c in rubric_schema.get("criteria", [])]
+    pc = data.get("per_criterion", {}) or {}
+    for n in crit_names:
+        pc.setdefault(n, None)
+    data["per_criterion"] = pc
+    if "confidence" not in data:
+        data["confidence"] = "medium"
+    return data
+
+def _grade_fallback(e: Exception) -> dict:
+    return {
+        "overall": None,
+        "per_criterion": {},
+        "rationales": {"_note": f"Grading failed: {e}"},
+        "confidence": "low",
+    }
+
 def grade_with_rubric(essay_text: str, rubric_schema: dict,
-                      anchors: list = None, leniency: float = 0.5) -> dict:
+                      anchors: list = None, leniency: float = 0.5,
+                      on_delta: Optional[Callable[[str], None]] = None) -> dict:
     """
     Few-shot rubric grading.
     - rubric_schema: {"title","scale","criteria":[{"name","weight","descriptor_levels"}]}
     - anchors: optional list of prior graded samples (essay text + labels)
     - leniency: 0..1 (used as a hint, not hard math)
+    - on_delta: optional callback; streams the raw JSON reply piece by piece for live progress
     """
     try:
-        user_payload = {
-            "rubric_schema": rubric_schema,
-            "leniency_hint": float(leniency),
-            "anchors": _format_anchors(anchors)[:6],
-            "essay_text": essay_text,
-        }
-        resp = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": _GRADE_SYSTEM},
-                {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)}
-            ],
-            temperature=0.2,
-            max_tokens=1200,
+        return _cached_chat(
+            _grade_messages(essay_text, rubric_schema, anchors, leniency),
+            lambda raw: _finish_grade(raw, rubric_schema),
+            on_delta=on_delta,
+            temperature=0.2, max_tokens=1200, response_format=_grade_format(rubric_schema),
+        )
+    except Exception as e:
+        return _grade_fallback(e)
+
+async def agrade_with_rubric(essay_text: str, rubric_schema: dict,
+                             anchors: list = None, leniency: float = 0.5) -> dict:
+    """Async twin of grade_with_rubric."""
+    try:
+        return await _acached_chat(
+            _grade_messages(essay_text, rubric_schema, anchors, leniency),
+            lambda raw: _finish_grade(raw, rubric_schema),
+            temperature=0.2, max_tokens=1200, response_format=_grade_format(rubric_schema),
         )
-        data = json.loads(resp["choices"][0]["message"]["content"])
-        # Ensure every criterion has a slot
-        crit_names = [c["name"] for c in rubric_schema.get("criteria", [])]
-        pc = data.get("per_criterion", {}) or {}
-        for n in crit_names:
-            pc.setdefault(n, None)
-        data["per_criterion"] = pc
-        if "confidence" not in data:
-            data["confidence"] = "medium"
-        return data
     except Exception as e:
-        return {
-            "overall": None,
-            "per_criterion": {},
-            "rationales": {"_note": f"Grading failed: {e}"},
-            "confidence": "low",
-        }
+        return _grade_fallback(e)
+
+async def agrade_many(essays: List[str], rubric_schema: dict, anchors: list = None,
+                      leniency: float = 0.5, max_concurrency: int = 8) -> List[dict]:
+    """
+    Grade a class set concurrently; results come back in essay order.
+    - max_concurrency: in-flight ceiling; size it to the account's RPM/TPM limits
+    """
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _run(essay: str) -> dict:
+        async with sem:
+            return await agrade_with_rubric(essay, rubric_schema, anchors, leniency)
+
+    return list(await asyncio.gather(*(_run(e) for e in essays)))
+
+def grade_many(essays: List[str], rubric_schema: dict, anchors: list = None,
+               leniency: float = 0.5, max_concurrency: int = 8) -> List[dict]:
+    """
+    Blocking twin of agrade_many for sync callers (Streamlit).
+    Fans out over threads on the pooled sync client; asyncio.run here would strand the shared
+    async client's connections on a loop that closes after each batch.
+    """
+    if not essays:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(essays)))) as pool:
+        return list(pool.map(lambda e: grade_with_rubric(e, rubric_schema, anchors, leniency), essays))
@@ -1,13 +1,20 @@
 # src/analyzer.py
 import re
 import string
+import functools
 from typing import Dict, Any, List
 from collections import Counter
 
-# spaCy is preferred but we'll fail gracefully if the model isn't available
+# spaCy is preferred but we'll fail gracefully if the model isn't available.
+# The analyzers only read token attributes (is_alpha/is_punct) and sentence boundaries, so the
+# statistical pipes are not even loaded; the rule-based sentencizer stands in for the parser.
 try:
     import spacy
-    _NLP = spacy.load("en_core_web_sm")
+    _NLP = spacy.load(
+        "en_core_web_sm",
+        exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner", "senter"],
+    )
+    _NLP.add_pipe("sentencizer")
 except Exception:
     _NLP = None
 
@@ -32,14 +39,15 @@ def analyze_text(text: str) -> Dict[str, Any]:
         var_len = (max(sentence_lengths) - min(sentence_lengths)) if sentences else 0
 
         words = _fallback_tokens(text)
-        vocab_richness = len(set(w.lower() for w in words)) / len(words) if words else 0.0
+        lowered = [w.lower() for w in words]
+        vocab_richness = len(set(lowered)) / len(words) if words else 0.0
 
         # Simple stopword set to approximate spaCy behavior
         stopwords = _BASIC_STOPWORDS
-        non_stop_words = [w for w in words if w.lower() not in stopwords]
+        non_stop_words = [w for w, lw in zip(words, lowered) if lw not in stopwords]
         freq_words = Counter(non_stop_words).most_common(5)
     else:
-        doc = _NLP(text)
+        doc = _parse(text)
         # Sentence metrics
         sentences = list(doc.sents)
         sentence_lengths = [len([t for t in s if not t.is_punct]) for s in sentences]
@@ -55,15 +63,16 @@ def analyze_text(text: str) -> Dict[str, Any]:
         non_stop_words = filter_stopwords(words, stopwords)
         freq_words = Counter(non_stop_words).most_common(5)
 
-    # Punctuation usage
-    punct = Counter([c for c in text if c in string.punctuation])
+    # Punctuation usage: C-level set intersection + str.count instead of a per-character Python loop
+    # (ordered by first appearance, as Counter over the text was)
+    punct = {p: text.count(p) for p in sorted(_PUNCT_SET.intersection(text), key=text.index)}
 
     return {
         "sentence_length_avg": round(avg_len, 2),
         "sentence_length_var": var_len,
         "vocab_richness": round(vocab_richness, 2),
         "frequent_words": [w for w, _ in freq_words],
-        "punctuation_use": dict(punct),
+        "punctuation_use": punct,
     }
 
 # ==========================================================
@@ -71,9 +80,10 @@ def analyze_text(text: str) -> Dict[str, Any]:
 # ==========================================================
 
 _WORD_RE = re.compile(r"[A-Za-z']+")
+_PUNCT_SET = frozenset(string.punctuation)
 
 # A minimal stopword list for fallback mode
-_BASIC_STOPWORDS = set(
+_BASIC_STOPWORDS = frozenset(
     """
     the be to of and a in that have i it for not on with he as you do at this
     but his by from they we say her she or an will my one all would there their
@@ -81,19 +91,35 @@ _BASIC_STOPWORDS = set(
     """.split()
 )
 
+# FlowState cue patterns fused into one alternation: a single finditer pass, counted by group name.
+# The groups cannot overlap (no cue word ends in -ed or is a form of "be"), so counts match separate findalls.
+_FLOW_CUES_RE = re.compile(
+    r"\b(?P<figurative>like|as if|as though)\b"
+    r"|\b(?P<interjection>hey|wow|ah|oh|hmm|ugh|ha)\b"
+    r"|\b(?P<hedge>maybe|kind of|sort of|perhaps|somewhat|a bit)\b"
+    r"|\b(?P<passive>(?:be|been|being|is|was|were|are)\b\s+\b\w+ed)\b"
+)
+_FLOW_PUNCT = frozenset(",.—-:;!?()")
+_SENT_SPLIT_RE = re.compile(r"[.!?]+")
+
 def _fallback_tokens(text: str) -> List[str]:
     """Regex tokenizer used when spaCy isn't available."""
     return _WORD_RE.findall(text)
 
+@functools.lru_cache(maxsize=16)
+def _parse(text: str):
+    """One spaCy parse per distinct text; repeat analyses of the same writing reuse the Doc."""
+    return _NLP(text)
+
+def _alpha_tokens(span) -> List[str]:
+    """Alphabetic tokens (contractions included) from a spaCy Doc or sentence Span."""
+    return [t.text for t in span if t.is_alpha or ("'" in t.text and t.text.replace("'", "").isalpha())]
+
 def _tokenize_alpha(text: str) -> List[str]:
     """Tokenize using spaCy when available; fallback to regex otherwise."""
     if _NLP is None:
         return _fallback_tokens(text)
-    doc = _NLP(text)
-    return [t.text for t in doc if t.is_alpha or ("'" in t.text and t.text.replace("'", "").isalpha())]
-
-def _unique_types(tokens: List[str]) -> int:
-    return len(set(t.lower() for t in tokens))
+    return _alpha_tokens(_parse(text))
 
 def _clamp(x: float, lo: float = 0.0, hi: float = 1.0) -> float:
     return max(lo, min(hi, x))
@@ -105,18 +131,42 @@ def analyze_flow_text(text: str) -> Dict[str, Any]:
       - word_count, vocab_type_count, vocab_ttr, repetition_rate
       - playfulness_score, clarity_score, creativity_score
     """
-    tokens = _tokenize_alpha(text)
+    # Parse once: tokens and per-sentence lengths both come from the same Doc.
+    if _NLP is None:
+        tokens = _fallback_tokens(text)
+        sentences = [s.strip() for s in _SENT_SPLIT_RE.split(text) if s.strip()]
+        sentence_lengths = [len(_fallback_tokens(s)) for s in sentences]
+        return _flow_metrics(text, tokens, sentence_lengths)
+    return _flow_metrics_from_doc(text, _parse(text))
+
+def analyze_flow_text_batch(texts: List[str], batch_size: int = 64) -> List[Dict[str, Any]]:
+    """
+    analyze_flow_text over many texts (a class set, a dashboard list); results in input order.
+    With spaCy, texts are tokenized in batches via nlp.pipe instead of one call per text.
+    """
+    if _NLP is None:
+        return [analyze_flow_text(t) for t in texts]
+    docs = _NLP.pipe(texts, batch_size=batch_size)
+    return [_flow_metrics_from_doc(t, d) for t, d in zip(texts, docs)]
+
+def _flow_metrics_from_doc(text: str, doc) -> Dict[str, Any]:
+    tokens = _alpha_tokens(doc)
+    sentence_lengths = [len(_alpha_tokens(s)) for s in doc.sents if s.text.strip()]
+    return _flow_metrics(text, tokens, sentence_lengths)
+
+def _flow_metrics(text: str, tokens: List[str], sentence_lengths: List[int]) -> Dict[str, Any]:
     word_count = len(tokens)
-    types = _unique_types(tokens)
+    lowered = [t.lower() for t in tokens]  # lowercase once; reused for types and rare words
+    types = len(set(lowered))
     ttr = (types / word_count) if word_count else 0.0
     repetition_rate = 1.0 - (types / word_count) if word_count else 0.0
 
-    txt_lower = text.lower()
+    cues = Counter(m.lastgroup for m in _FLOW_CUES_RE.finditer(text.lower()))
 
     # --- Playfulness (0..1): punctuation variety + figurative markers + interjections + lexical variety ---
-    punct_variety = len(set(ch for ch in text if ch in [",", ".", "—", "-", ":", ";", "!", "?", "(", ")"]))
-    figurative_hits = len(re.findall(r"\b(like|as if|as though)\b", txt_lower))
-    interjections = len(re.findall(r"\b(hey|wow|ah|oh|hmm|ugh|ha)\b", txt_lower))
+    punct_variety = sum(1 for ch in _FLOW_PUNCT if ch in text)
+    figurative_hits = cues["figurative"]
+    interjections = cues["interjection"]
     playfulness = _clamp(
         0.15 * min(punct_variety, 6)
         + 0.2 * figurative_hits
@@ -125,11 +175,9 @@ def analyze_flow_text(text: str) -> Dict[str, Any]:
     )
 
     # --- Clarity (0..1): shorter/cleaner sentences, fewer hedges, fewer passive cues ---
-    hedges = len(re.findall(r"\b(maybe|kind of|sort of|perhaps|somewhat|a bit)\b", txt_lower))
-    sentences = re.split(r"[.!?]+", text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    avg_sent_len = (sum(len(_tokenize_alpha(s)) for s in sentences) / len(sentences)) if sentences else 0.0
-    passive_cues = len(re.findall(r"\b(be|been|being|is|was|were|are)\b\s+\b\w+ed\b", txt_lower))
+    hedges = cues["hedge"]
+    avg_sent_len = (sum(sentence_lengths) / len(sentence_lengths)) if sentence_lengths else 0.0
+    passive_cues = cues["passive"]
     clarity = _clamp(
         0.6 * _clamp(1.0 - (max(0.0, avg_sent_len - 18.0) / 22.0))  # prefer around ~18 words/sentence
         + 0.25 * _clamp(1.0 - hedges / 4.0)
@@ -137,9 +185,9 @@ def analyze_flow_text(text: str) -> Dict[str, Any]:
     )
 
     # --- Creativity (0..1): rare-ish words + lexical variety ---
-    common_words = _BASIC_STOPWORDS
-    rare_tokens = [t for t in (tok.lower() for tok in tokens) if t not in common_words and len(t) > 6]
-    rare_rate = len(rare_tokens) / word_count if word_count else 0.0
+    # Length test first: it is the cheaper check and already rules out every current stopword
+    rare_count = sum(1 for t in lowered if len(t) > 6 and t not in _BASIC_STOPWORDS)
+    rare_rate = rare_count / word_count if word_count else 0.0
     creativity = _clamp(0.7 * _clamp(rare_rate / 0.15) + 0.3 * _clamp(ttr / 0.6))
 
     return {
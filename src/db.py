@@ -1,8 +1,109 @@
 # src/db.py
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta, timezone
-
+import time
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import functools
+import threading
+from typing import Optional, List, Dict, Any, Sequence
+from datetime import datetime, timezone
+
+from . import pg
 from .supabase_client import supabase
+from .llm_cache import ExactCache
+
+def _chunked_upsert(table: str, rows: List[Dict[str, Any]], chunk: int = 1000,
+                    on_conflict: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Upsert rows in slices of `chunk` so a bulk write stays under PostgREST's request-size limit
+    while each request still carries enough rows to amortize the round trip. Returns all written rows.
+    """
+    out: List[Dict[str, Any]] = []
+    for i in range(0, len(rows), chunk):
+        q = supabase.table(table)
+        q = q.upsert(rows[i:i + chunk], on_conflict=on_conflict) if on_conflict else q.upsert(rows[i:i + chunk])
+        out.extend(q.execute().data or [])
+    return out
+
+class _Batcher:
+    """
+    Background writer for telemetry only: rows are queued and sent as one multi-row INSERT every
+    `flush_n` rows or `flush_ms` milliseconds, whichever comes first. Drained at exit.
+    The shared client carries whichever session was restored last, so each row is queued with the
+    access token of the caller that enqueued it and every flush sends one INSERT per token.
+    A failed flush is logged and dropped: never queue rows a user would miss.
+    """
+
+    def __init__(self, table: str, flush_n: int = 200, flush_ms: int = 250):
+        self.table = table
+        self.flush_n = flush_n
+        self.flush_s = flush_ms / 1000.0
+        self._q: "queue.Queue[tuple]" = queue.Queue()  # (access_token, row)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, token: str, row: Dict[str, Any]) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"db-batch-{self.table}", daemon=True)
+                self._thread.start()
+        self._q.put((token, row))
+
+    def _take(self) -> List[tuple]:
+        batch = [self._q.get()]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.flush_n:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[tuple]) -> None:
+        by_token: Dict[str, List[Dict[str, Any]]] = {}
+        for token, row in batch:
+            by_token.setdefault(token, []).append(row)
+        for token, rows in by_token.items():
+            try:
+                q = supabase.table(self.table).insert(rows)
+                q.request.headers["Authorization"] = f"Bearer {token}"  # this request only, not the client
+                q.execute()
+            except Exception:
+                logging.getLogger(__name__).exception("dropped %d queued %s rows", len(rows), self.table)
+
+    def _run(self) -> None:
+        while True:
+            self._write(self._take())
+
+    def drain(self) -> None:
+        """Write whatever is still queued (called at interpreter exit)."""
+        batch: List[tuple] = []
+        while True:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(batch), self.flush_n):
+            self._write(batch[i:i + self.flush_n])
+
+_ACTIVITY_BATCHER = _Batcher("user_activity_log")
+
+@atexit.register
+def _drain_batchers() -> None:
+    _ACTIVITY_BATCHER.drain()
+
+def _access_token() -> Optional[str]:
+    """The access token the shared client holds right now (the caller's, right after restore_session)."""
+    try:
+        session = supabase.auth.get_session()
+    except Exception:
+        return None
+    return session.access_token if session else None
 
 # ---------- FlowState Defaults ----------
 # Fill these with your 10 strong defaults (plain strings).
@@ -23,6 +124,10 @@ def get_default_flow_prompts() -> List[Dict[str, Any]]:
     """Return defaults shaped like DB rows, so callers can treat them the same."""
     return [{"id": None, "text": p, "source": "default"} for p in DEFAULT_FLOW_PROMPTS]
 
+@functools.lru_cache(maxsize=1)
+def _defaults() -> tuple:
+    return tuple(get_default_flow_prompts())
+
 
 # ---------- Auth ----------
 def sign_up(email: str, password: str):
@@ -38,6 +143,17 @@ def set_session(access_token: str, refresh_token: str):
     # Restore a session into the client (for Streamlit reruns)
     return supabase.auth.set_session(access_token, refresh_token)
 
+def restore_session(access_token: str, refresh_token: str):
+    """
+    Put a stored session back on the client for this rerun and return it (session.user is the user).
+    Free when the client already holds this access token; otherwise set_session verifies or refreshes it.
+    The returned session may carry refreshed tokens: store those for the next rerun.
+    """
+    current = supabase.auth.get_session()
+    if current and current.access_token == access_token:
+        return current
+    return supabase.auth.set_session(access_token, refresh_token).session
+
 def sign_out():
     supabase.auth.sign_out()
 
@@ -47,22 +163,59 @@ def save_writing(user_id: str, text: str, title: Optional[str] = None, metadata:
     res = supabase.table("writings").insert(data).execute()
     return (res.data or [None])[0]
 
-def list_writings(user_id: str) -> List[Dict[str, Any]]:
-    res = (
+def list_writings(user_id: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    List view rows only (no essay text), newest first; fetch the body with get_writing_text when it is opened.
+    - limit/offset: one page of rows (limit=None returns everything from offset on)
+    """
+    if pg.enabled():
+        try:
+            return pg.run(pg.list_writings(user_id, limit, offset))
+        except Exception:
+            pass  # fall back to PostgREST
+    q = (
         supabase.table("writings")
-        .select("id, title, text, created_at")
+        .select("id, title, created_at")
         .eq("user_id", user_id)
         .order("created_at", desc=True)
-        .execute()
     )
+    if limit is not None:
+        q = q.range(offset, offset + limit - 1)
+    elif offset:
+        q = q.offset(offset)
+    res = q.execute()
     return res.data or []
 
+def writings_version(user_id: str) -> str:
+    """Change token for list_writings ("<count>:<latest created_at>"), from the writings_version RPC."""
+    return supabase.rpc("writings_version", {"uid": user_id}).execute().data or ""
+
+def find_writing_by_text(user_id: str, text: str) -> Optional[Dict[str, Any]]:
+    """
+    The user's latest writing with exactly this text, matched on its sha256 (find_writing_by_text RPC).
+    Returns {"id", "title", "created_at", "feedback"} (feedback = newest stored reflection or None), or None.
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    res = supabase.rpc("find_writing_by_text", {"p_user": user_id, "p_hash": digest}).execute()
+    return res.data or None
+
 def get_writing(writing_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("writings").select("*").eq("id", writing_id).single().execute()
-    return res.data
+    res = supabase.table("writings").select("*").eq("id", writing_id).maybe_single().execute()
+    return res.data if res else None
+
+def get_writing_text(writing_id: str, user_id: Optional[str] = None) -> str:
+    # user_id (when given) scopes the read to its owner on top of RLS
+    q = supabase.table("writings").select("text").eq("id", writing_id)
+    if user_id:
+        q = q.eq("user_id", user_id)
+    res = q.limit(1).execute()
+    rows = res.data or []
+    return (rows[0].get("text") if rows else None) or ""
 
+# The count_* helpers ask PostgREST for count=estimated: exact up to the server's max-rows, the
+# planner's estimate beyond it, so dashboard numbers never cost a full COUNT(*).
 def count_writings(user_id: str) -> int:
-    res = supabase.table("writings").select("id", count="exact").eq("user_id", user_id).execute()
+    res = supabase.table("writings").select("id", count="estimated", head=True).eq("user_id", user_id).execute()
     return res.count or 0
 
 # ---------- Writing Insights ----------
@@ -101,6 +254,28 @@ def insert_companion_feedback(writing_id: str, feedback: str, mode: str = "spotl
     payload = {"writing_id": writing_id, "feedback": feedback, "mode": mode}
     return supabase.table("companion_feedback").insert(payload).execute()
 
+def record_companion_results(
+    user_id: str,
+    writing_id: str,
+    insight: Dict[str, Any],
+    feedback: Optional[str] = None,
+    mode: str = "spotlight",
+) -> Dict[str, Any]:
+    """
+    Insert a writing's insight and (optionally) its reflection, and refresh the style profile and
+    snapshot on every 5th entry, in one transaction via the record_companion_results RPC.
+    - insight: insert_writing_insight's fields (intention, tone, energy, observations, micro_suggestions, metrics)
+    Returns {"insight": row, "feedback": row or None, "entries": int, "snapshot": str or None}.
+    """
+    res = supabase.rpc("record_companion_results", {
+        "p_user": user_id,
+        "p_writing": writing_id,
+        "p_insight": insight,
+        "p_feedback": feedback,
+        "p_mode": mode,
+    }).execute()
+    return res.data or {}
+
 def get_companion_feedback(writing_id: str) -> List[Dict[str, Any]]:
     res = (
         supabase.table("companion_feedback")
@@ -117,8 +292,8 @@ def upsert_style_profile(user_id: str, summary: str, traits: Optional[dict] = No
     return supabase.table("style_profiles").upsert(payload).execute()
 
 def get_style_profile(user_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("style_profiles").select("*").eq("user_id", user_id).single().execute()
-    return res.data
+    res = supabase.table("style_profiles").select("*").eq("user_id", user_id).maybe_single().execute()
+    return res.data if res else None
 
 def insert_style_snapshot(user_id: str, snapshot: str, signals: Optional[dict] = None):
     payload = {"user_id": user_id, "snapshot": snapshot, "signals": signals or {}}
@@ -139,19 +314,25 @@ def list_style_snapshots(user_id: str) -> List[Dict[str, Any]]:
 # ==========================================================
 
 # ---------- Prompts ----------
-import random
-
-def random_flow_prompt(
-    tag: Optional[str] = None,
-    difficulty: Optional[int] = None,
-    include_defaults: bool = True  # <-- NEW: include your hardcoded defaults by default
-) -> Optional[Dict[str, Any]]:
-    """
-    Pick a random FlowState prompt.
-    - Pulls up to 50 active prompts from Supabase (optionally filtered by tag/difficulty).
-    - If include_defaults=True, mixes in your hardcoded defaults even when the DB has rows.
-    """
-    q = supabase.table("flow_prompts").select("*")
+# Candidate prompts per (tag, difficulty), kept for 5 minutes so starting a burst or loading the
+# next prompt picks locally. Cleared when a prompt is created or (de)activated in this process.
+_PROMPT_POOL_CACHE = ExactCache(maxsize=64, ttl=300)
+
+def _prompt_candidates(
+    tag: Optional[str],
+    difficulty: Optional[int],
+    force_db: bool = False,
+    user_id: Optional[str] = None,
+) -> tuple:
+    # The cache is process-wide and RLS decides which prompts a caller sees: key it on the caller too
+    key = (user_id, tag, difficulty)
+    if not force_db:
+        hit = _PROMPT_POOL_CACHE.get(key)
+        if hit is not None:
+            return hit
+
+    # Callers only read id and text; keep the cached candidate rows small
+    q = supabase.table("flow_prompts").select("id, text")
 
     if tag is not None:
         q = q.eq("tag", tag)
@@ -165,16 +346,29 @@ def random_flow_prompt(
         pass
 
     res = q.order("created_at", desc=True).limit(50).execute()
-    rows = res.data or []
+    rows = tuple(res.data or [])
+    _PROMPT_POOL_CACHE.set(key, rows)
+    return rows
 
-    pool = rows[:]  # DB prompts
-    if include_defaults:
-        pool += get_default_flow_prompts()  # your 10 defaults
+def random_flow_prompt(
+    tag: Optional[str] = None,
+    difficulty: Optional[int] = None,
+    include_defaults: bool = True,  # <-- NEW: include your hardcoded defaults by default
+    force_db: bool = False,
+    user_id: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Pick a random FlowState prompt.
+    - Pulls up to 50 active prompts from Supabase (optionally filtered by tag/difficulty), cached per user for 5 minutes.
+    - If include_defaults=True, mixes in your hardcoded defaults even when the DB has rows.
+    - force_db=True refreshes the cached candidates first.
+    """
+    pool = _prompt_candidates(tag, difficulty, force_db, user_id) + (_defaults() if include_defaults else ())
 
     if not pool:
         return None
 
-    return random.choice(pool)
+    return dict(random.choice(pool))
 
 def list_all_flow_prompts(include_defaults: bool = True) -> List[Dict[str, Any]]:
     res = supabase.table("flow_prompts").select("*").order("created_at", desc=True).limit(200).execute()
@@ -210,13 +404,14 @@ def insert_flow_attempt(
     end_time: Optional[datetime],
     meta: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
     payload = {
         "session_id": session_id,
         "prompt_id": prompt_id,
         "user_id": user_id,
         "response_text": response_text,
-        "start_time": (start_time or datetime.now(timezone.utc)).isoformat(),
-        "end_time": (end_time or datetime.now(timezone.utc)).isoformat(),
+        "start_time": (start_time or now).isoformat(),
+        "end_time": (end_time or now).isoformat(),
         "meta": meta or {},
     }
     res = supabase.table("flow_attempts").insert(payload).execute()
@@ -232,10 +427,22 @@ def insert_flow_metrics(
     res = supabase.table("flow_metrics").insert(payload).execute()
     return (res.data or [None])[0]
 
-def list_flow_recent_metrics(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+# What the Context Pack actually reads from recent metrics (it is serialized into the feedback prompt).
+FLOW_METRIC_FIELDS = (
+    "created_at", "word_count", "wpm", "vocab_ttr", "repetition_rate",
+    "playfulness_score", "clarity_score", "creativity_score", "composite_score",
+)
+
+def list_flow_recent_metrics(user_id: str, limit: int = 10,
+                             fields: Sequence[str] = FLOW_METRIC_FIELDS) -> List[Dict[str, Any]]:
+    if pg.enabled():
+        try:
+            return pg.run(pg.list_flow_recent_metrics(user_id, limit, fields))
+        except Exception:
+            pass  # fall back to PostgREST
     res = (
         supabase.table("flow_metrics")
-        .select("*")
+        .select(", ".join(fields))
         .eq("user_id", user_id)
         .order("created_at", desc=True)
         .limit(limit)
@@ -243,26 +450,70 @@ def list_flow_recent_metrics(user_id: str, limit: int = 10) -> List[Dict[str, An
     )
     return res.data or []
 
+# Numeric flow_metrics columns a baseline can average; names are checked here before they reach SQL
+BASELINE_FIELDS = frozenset({
+    "elapsed_seconds", "word_count", "wpm", "vocab_type_count", "vocab_ttr", "repetition_rate",
+    "playfulness_score", "clarity_score", "creativity_score", "composite_score",
+})
+
+def _check_baseline_fields(fields) -> None:
+    unknown = [f for f in fields if f not in BASELINE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown metric field(s) for baseline: {', '.join(map(str, unknown))}")
+
 def user_metric_baseline(user_id: str, metric_field: str, days: int = 7) -> Optional[float]:
     """
-    Rolling average for a metric over the past N days.
-    Returns None if not enough data.
+    Rolling average for a metric over the past N days (latest 200 attempts), via the flow_metric_baseline RPC.
+    Returns None if not enough data. Raises ValueError for a field outside BASELINE_FIELDS.
     """
-    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
-    res = (
-        supabase.table("flow_metrics")
-        .select(f"{metric_field}, created_at")
-        .eq("user_id", user_id)
-        .gte("created_at", since)
-        .order("created_at", desc=True)
-        .limit(200)
-        .execute()
-    )
-    rows = res.data or []
-    vals = [r.get(metric_field) for r in rows if r.get(metric_field) is not None]
-    if not vals:
-        return None
-    return sum(vals) / len(vals)
+    _check_baseline_fields((metric_field,))
+    if pg.enabled():
+        try:
+            return pg.run(pg.flow_metric_baseline(user_id, metric_field, days))
+        except Exception:
+            pass  # fall back to PostgREST
+    res = supabase.rpc(
+        "flow_metric_baseline", {"uid": user_id, "field": metric_field, "days": days}
+    ).execute()
+    return res.data
+
+def user_metric_baselines(user_id: str, metric_fields: Sequence[str], days: int = 7) -> Dict[str, Optional[float]]:
+    """
+    user_metric_baseline for several fields in one round trip (flow_metric_baselines RPC).
+    Returns {field: average or None}.
+    """
+    fields = list(dict.fromkeys(metric_fields))
+    if not fields:
+        return {}
+    _check_baseline_fields(fields)
+    if pg.enabled():
+        try:
+            return pg.run(pg.flow_metric_baselines(user_id, fields, days))
+        except Exception:
+            pass  # fall back to PostgREST
+    res = supabase.rpc(
+        "flow_metric_baselines", {"uid": user_id, "fields": fields, "days": days}
+    ).execute()
+    return res.data or {}
+
+def flow_feedback_context(user_id: str, prompt_id: Optional[str], n: int = 3,
+                          metric_fields: Sequence[str] = (), days: int = 7) -> Dict[str, Any]:
+    """
+    Micro-feedback inputs in one round trip (flow_feedback_context RPC):
+    - prompt: {"id", "text"} of prompt_id, or None
+    - recent: the user's last n attempts with their scores, newest first
+    - baselines: {field: average or None} as user_metric_baselines(metric_fields, days)
+    """
+    fields = list(dict.fromkeys(metric_fields))
+    _check_baseline_fields(fields)
+    res = supabase.rpc("flow_feedback_context", {
+        "p_user": user_id,
+        "p_prompt": prompt_id,
+        "p_n": n,
+        "p_fields": fields,
+        "p_days": days,
+    }).execute()
+    return res.data or {}
 
 # ---------- Feedback ----------
 def insert_flow_feedback(
@@ -274,34 +525,46 @@ def insert_flow_feedback(
     res = supabase.table("flow_feedback").insert(payload).execute()
     return (res.data or [None])[0]
 
+# ---------- Submit (attempt + metrics + feedback) ----------
+def record_flow_submit(
+    session_id: str,
+    prompt_id: Optional[str],
+    user_id: str,
+    response_text: str,
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    meta: Optional[Dict[str, Any]],
+    metrics: Dict[str, Any],
+    feedback_text: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Insert a FlowState attempt, its metrics and (optionally) its feedback in one transaction via the
+    record_flow_submit RPC. Returns {"attempt": row, "metrics": row, "feedback": row or None}.
+    """
+    now = datetime.now(timezone.utc)
+    res = supabase.rpc("record_flow_submit", {
+        "p_session": session_id,
+        "p_prompt": prompt_id,
+        "p_user": user_id,
+        "p_text": response_text,
+        "p_start": (start_time or now).isoformat(),
+        "p_end": (end_time or now).isoformat(),
+        "p_meta": meta or {},
+        "p_metrics": metrics,
+        "p_feedback": feedback_text,
+    }).execute()
+    return res.data or {}
+
 # ---------- Goals & Progress ----------
 def upsert_flow_goal(user_id: str, focus: str, target: float, window_days: int = 14, active: bool = True) -> Dict[str, Any]:
     """
-    Emulate upsert by (user_id, focus, active=True). If one exists, update; else insert.
+    Upsert by (user_id, focus, active=True): one INSERT ... ON CONFLICT against the partial unique
+    index, via the upsert_flow_goal RPC. active=False deactivates the current goal for that focus.
     """
-    existing = (
-        supabase.table("flow_goals")
-        .select("*")
-        .eq("user_id", user_id)
-        .eq("focus", focus)
-        .eq("active", True)
-        .limit(1)
-        .execute()
-        .data
-    )
-    if existing:
-        goal_id = existing[0]["id"]
-        res = (
-            supabase.table("flow_goals")
-            .update({"target": target, "window_days": window_days, "active": active})
-            .eq("id", goal_id)
-            .execute()
-        )
-        return (res.data or [None])[0]
-    else:
-        payload = {"user_id": user_id, "focus": focus, "target": target, "window_days": window_days, "active": active}
-        res = supabase.table("flow_goals").insert(payload).execute()
-        return (res.data or [None])[0]
+    res = supabase.rpc("upsert_flow_goal", {
+        "uid": user_id, "focus": focus, "target": target, "window_days": window_days, "active": active,
+    }).execute()
+    return res.data
 
 def active_flow_goals(user_id: str) -> List[Dict[str, Any]]:
     res = (
@@ -330,6 +593,7 @@ def create_flow_prompt(teacher_id: str, text: str, tags: Optional[List[str]] = N
         "active": active,
     }
     res = supabase.table("flow_prompts").insert(payload).execute()
+    _PROMPT_POOL_CACHE.clear()
     return (res.data or [None])[0]
 
 def list_flow_prompts_for_teacher(teacher_id: str, active_only: bool = True) -> List[Dict[str, Any]]:
@@ -342,13 +606,27 @@ def list_flow_prompts_for_teacher(teacher_id: str, active_only: bool = True) ->
 
 def set_flow_prompt_active(prompt_id: str, active: bool) -> None:
     supabase.table("flow_prompts").update({"active": active}).eq("id", prompt_id).execute()
+    _PROMPT_POOL_CACHE.clear()
 
 # ---------- Prompt ↔ Assignment linking ----------
 def assign_prompts_to_assignment(assignment_id: str, prompt_ids: List[str]) -> None:
+    """Link prompts to an assignment; duplicates and links that already exist are not re-sent."""
+    prompt_ids = list(dict.fromkeys(pid for pid in prompt_ids if pid))
     if not prompt_ids:
         return
-    rows = [{"assignment_id": assignment_id, "prompt_id": pid} for pid in prompt_ids]
-    supabase.table("flow_prompt_assignments").upsert(rows, on_conflict="assignment_id,prompt_id").execute()
+    existing = (
+        supabase.table("flow_prompt_assignments")
+        .select("prompt_id")
+        .eq("assignment_id", assignment_id)
+        .in_("prompt_id", prompt_ids)
+        .execute()
+        .data or []
+    )
+    linked = {r["prompt_id"] for r in existing}
+    rows = [{"assignment_id": assignment_id, "prompt_id": pid} for pid in prompt_ids if pid not in linked]
+    if not rows:
+        return
+    _chunked_upsert("flow_prompt_assignments", rows, on_conflict="assignment_id,prompt_id")
 
 def remove_prompt_from_assignment(assignment_id: str, prompt_id: str) -> None:
     supabase.table("flow_prompt_assignments").delete().eq("assignment_id", assignment_id).eq("prompt_id", prompt_id).execute()
@@ -372,18 +650,33 @@ def list_prompts_for_assignment(assignment_id: str) -> List[Dict[str, Any]]:
         out.append(p)
     return out
 
+def random_teacher_prompt(teacher_id: str) -> Optional[Dict[str, Any]]:
+    """One random active prompt ({"id", "text"}) from the teacher's library, picked server-side (random_teacher_prompt RPC)."""
+    res = supabase.rpc("random_teacher_prompt", {"tid": teacher_id}).execute()
+    return res.data or None
+
 def random_assigned_prompt(assignment_id: str) -> Optional[Dict[str, Any]]:
-    rows = list_prompts_for_assignment(assignment_id)
-    rows = [r for r in rows if r.get("active", True)]
-    if not rows:
-        return None
-    import random
-    return random.choice(rows)
+    """One random active prompt for the assignment, picked server-side (see the random_assigned_prompt RPC)."""
+    res = supabase.rpc("random_assigned_prompt", {"aid": assignment_id}).execute()
+    return res.data or None
 
 # --- Profiles / Roles ---
+# Profiles (roles especially) rarely change but are read on every page render; keep them for 5 minutes.
+# upsert_profile drops the entry, so a user's own edits show up immediately.
+_PROFILE_CACHE = ExactCache(maxsize=10_000, ttl=300)
+
 def get_profile(user_id: str):
-    res = supabase.table("profiles").select("*").eq("id", user_id).single().execute()
-    return res.data
+    hit = _PROFILE_CACHE.get(user_id)
+    if hit is not None:
+        return hit
+    res = supabase.table("profiles").select("*").eq("id", user_id).maybe_single().execute()
+    data = res.data if res else None
+    if data:
+        _PROFILE_CACHE.set(user_id, data)
+    return data
+
+def invalidate_profile(user_id: str) -> None:
+    _PROFILE_CACHE.delete(user_id)
 
 def upsert_profile(user_id: str, display_name: str = None, school: str = None, role: str = None):
     payload = {"id": user_id}
@@ -391,11 +684,28 @@ def upsert_profile(user_id: str, display_name: str = None, school: str = None, r
     if school is not None: payload["school"] = school
     if role is not None: payload["role"] = role
     res = supabase.table("profiles").upsert(payload).execute()
+    invalidate_profile(user_id)
+    invalidate_role(user_id)
     return (res.data or [None])[0]
 
+# is_teacher answers, kept briefly: it is checked several times per rerun
+_ROLE_CACHE = ExactCache(maxsize=1024, ttl=60)
+
+def invalidate_role(user_id: str) -> None:
+    _ROLE_CACHE.delete(user_id)
+
 def is_teacher(user_id: str) -> bool:
-    p = get_profile(user_id)
-    return bool(p and p.get("role") in ("teacher","admin"))
+    hit = _ROLE_CACHE.get(user_id)
+    if hit is not None:
+        return hit
+    # A cached full profile answers for free; otherwise fetch just the role column
+    p = _PROFILE_CACHE.get(user_id)
+    if p is None:
+        rows = supabase.table("profiles").select("role").eq("id", user_id).limit(1).execute().data
+        p = rows[0] if rows else None
+    teacher = bool(p and p.get("role") in ("teacher","admin"))
+    _ROLE_CACHE.set(user_id, teacher)
+    return teacher
 
 # ====== GradeSim: Rubrics, Criteria, Samples, Grader Versions, Requests/Results ======
 
@@ -424,8 +734,8 @@ def list_rubrics(teacher_id: str) -> List[Dict[str, Any]]:
     return res.data or []
 
 def get_rubric(rubric_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("rubrics").select("*").eq("id", rubric_id).single().execute()
-    return res.data
+    res = supabase.table("rubrics").select("*").eq("id", rubric_id).maybe_single().execute()
+    return res.data if res else None
 
 def archive_rubric(rubric_id: str, archived: bool = True) -> Optional[Dict[str, Any]]:
     res = supabase.table("rubrics").update({"archived": archived}).eq("id", rubric_id).execute()
@@ -443,6 +753,25 @@ def add_rubric_criterion(rubric_id: str, name: str, descriptor_levels: Dict[str,
     res = supabase.table("rubric_criteria").insert(payload).execute()
     return (res.data or [None])[0]
 
+def add_rubric_criteria(rubric_id: str, criteria: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert several criteria in one multi-row request (add_rubric_criterion, in bulk).
+    - criteria: [{"name", "descriptor_levels", "weight"}, ...]; weight defaults to 0.25 as there
+    """
+    rows = [
+        {
+            "rubric_id": rubric_id,
+            "name": c["name"],
+            "descriptor_levels": c["descriptor_levels"],
+            "weight": c.get("weight", 0.25),
+        }
+        for c in criteria
+    ]
+    if not rows:
+        return []
+    res = supabase.table("rubric_criteria").insert(rows).execute()
+    return res.data or []
+
 def list_rubric_criteria(rubric_id: str) -> List[Dict[str, Any]]:
     res = (
         supabase.table("rubric_criteria")
@@ -465,20 +794,21 @@ def update_rubric_criterion(criterion_id: str, name: Optional[str] = None,
     return (res.data or [None])[0]
 
 def get_rubric_criterion(criterion_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("rubric_criteria").select("*").eq("id", criterion_id).single().execute()
-    return res.data
+    res = supabase.table("rubric_criteria").select("*").eq("id", criterion_id).maybe_single().execute()
+    return res.data if res else None
 
 def delete_rubric_criterion(criterion_id: str) -> None:
     supabase.table("rubric_criteria").delete().eq("id", criterion_id).execute()
 
 # ---------- Teacher Grading Samples (anchors) ----------
-def add_grading_sample(teacher_id: str, rubric_id: str, title: Optional[str],
-                       text: str, overall: Optional[float],
-                       per_criterion: Optional[Dict[str, Any]],
+def add_grading_sample(teacher_id: str, rubric_id: str, assignment_id: Optional[str] = None,
+                       title: Optional[str] = None, text: str = "", overall: Optional[float] = None,
+                       per_criterion: Optional[Dict[str, Any]] = None,
                        rationales: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     payload = {
         "teacher_id": teacher_id,
         "rubric_id": rubric_id,
+        "assignment_id": assignment_id,
         "title": title,
         "text": text,
         "overall": overall,
@@ -488,63 +818,56 @@ def add_grading_sample(teacher_id: str, rubric_id: str, title: Optional[str],
     res = supabase.table("grading_samples").insert(payload).execute()
     return (res.data or [None])[0]
 
+# What the sample lists show; the essay text and rationales are only fetched for anchors actually used
+GRADING_SAMPLE_LIST_FIELDS = ("id", "title", "overall", "per_criterion", "created_at")
+
 def list_grading_samples(teacher_id: str, rubric_id: Optional[str] = None,
-                         limit: int = 50) -> List[Dict[str, Any]]:
-    q = (
-        supabase.table("grading_samples")
-        .select("*")
-        .eq("teacher_id", teacher_id)
-        .order("created_at", desc=True)
-        .limit(limit)
-    )
+                         assignment_id: Optional[str] = None, limit: int = 50,
+                         fields: Sequence[str] = ("*",)) -> List[Dict[str, Any]]:
+    q = (supabase.table("grading_samples").select(", ".join(fields)).eq("teacher_id", teacher_id)
+         .order("created_at", desc=True).limit(limit))
     if rubric_id:
         q = q.eq("rubric_id", rubric_id)
+    if assignment_id:
+        q = q.eq("assignment_id", assignment_id)
     res = q.execute()
     return res.data or []
 
 def get_grading_sample(sample_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("grading_samples").select("*").eq("id", sample_id).single().execute()
-    return res.data
+    res = supabase.table("grading_samples").select("*").eq("id", sample_id).maybe_single().execute()
+    return res.data if res else None
+
+def get_grading_samples(sample_ids: Sequence[str]) -> List[Dict[str, Any]]:
+    """Full rows for the given ids in one request, in the order of sample_ids (missing ids are skipped)."""
+    ids = list(dict.fromkeys(sample_ids))
+    if not ids:
+        return []
+    res = supabase.table("grading_samples").select("*").in_("id", ids).execute()
+    by_id = {r["id"]: r for r in res.data or []}
+    return [by_id[i] for i in ids if i in by_id]
 
 def delete_grading_sample(sample_id: str) -> None:
     supabase.table("grading_samples").delete().eq("id", sample_id).execute()
 
 # ---------- Grader Versions ----------
-def _next_grader_version_number(teacher_id: str, rubric_id: str) -> int:
-    res = (
-        supabase.table("teacher_grader_versions")
-        .select("version")
-        .eq("teacher_id", teacher_id)
-        .eq("rubric_id", rubric_id)
-        .order("version", desc=True)
-        .limit(1)
-        .execute()
-    )
-    if res.data:
-        return int(res.data[0]["version"]) + 1
-    return 1
-
 def create_grader_version(teacher_id: str, rubric_id: str, config: Dict[str, Any],
                           method: str = "few_shot_prompt", train_stats: Optional[Dict[str, Any]] = None,
                           is_active: bool = False, version: Optional[int] = None) -> Dict[str, Any]:
-    ver = version or _next_grader_version_number(teacher_id, rubric_id)
-    payload = {
-        "teacher_id": teacher_id,
-        "rubric_id": rubric_id,
-        "version": ver,
+    """Insert a grader version; the RPC numbers it max(version) + 1 in the same statement when `version` is unset."""
+    res = supabase.rpc("create_grader_version", {
+        "tid": teacher_id,
+        "rid": rubric_id,
         "method": method,
         "config": config or {},
         "train_stats": train_stats,
         "is_active": is_active,
-    }
-    res = supabase.table("teacher_grader_versions").insert(payload).execute()
-    return (res.data or [None])[0]
+        "version": version or None,
+    }).execute()
+    return res.data
 
 def set_active_grader_version(teacher_id: str, rubric_id: str, version_id: str) -> None:
-    # Deactivate all versions for that rubric/teacher
-    supabase.table("teacher_grader_versions").update({"is_active": False}).eq("teacher_id", teacher_id).eq("rubric_id", rubric_id).execute()
-    # Activate the chosen one
-    supabase.table("teacher_grader_versions").update({"is_active": True}).eq("id", version_id).execute()
+    # One UPDATE flips every version of the pair (is_active = id = version_id); see the migration
+    supabase.rpc("set_active_grader_version", {"tid": teacher_id, "rid": rubric_id, "vid": version_id}).execute()
 
 def list_grader_versions(teacher_id: str, rubric_id: str) -> List[Dict[str, Any]]:
     res = (
@@ -605,8 +928,8 @@ def insert_grade_result(request_id: str, overall: float, per_criterion: Dict[str
     return (res.data or [None])[0]
 
 def get_grade_result_by_request(request_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("grade_results").select("*").eq("request_id", request_id).single().execute()
-    return res.data
+    res = supabase.table("grade_results").select("*").eq("request_id", request_id).maybe_single().execute()
+    return res.data if res else None
 
 def list_grade_requests_for_teacher(teacher_id: str, limit: int = 50) -> List[Dict[str, Any]]:
     res = (
@@ -654,8 +977,8 @@ def list_assignments(teacher_id: str, rubric_id: Optional[str] = None) -> List[D
     return res.data or []
 
 def get_assignment(assignment_id: str) -> Optional[Dict[str, Any]]:
-    res = supabase.table("assignments").select("*").eq("id", assignment_id).single().execute()
-    return res.data
+    res = supabase.table("assignments").select("*").eq("id", assignment_id).maybe_single().execute()
+    return res.data if res else None
 
 def update_assignment(assignment_id: str, **patch) -> Optional[Dict[str, Any]]:
     if not patch:
@@ -666,42 +989,15 @@ def update_assignment(assignment_id: str, **patch) -> Optional[Dict[str, Any]]:
 def delete_assignment(assignment_id: str) -> None:
     supabase.table("assignments").delete().eq("id", assignment_id).execute()
 
-# ---------- Grading Samples (updated to include assignment_id) ----------
-def add_grading_sample(teacher_id: str, rubric_id: str, assignment_id: str,
-                       title: Optional[str], text: str, overall: Optional[float],
-                       per_criterion: Optional[Dict[str, Any]],
-                       rationales: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    payload = {
-        "teacher_id": teacher_id,
-        "rubric_id": rubric_id,
-        "assignment_id": assignment_id,
-        "title": title,
-        "text": text,
-        "overall": overall,
-        "per_criterion": per_criterion or {},
-        "rationales": rationales or {},
-    }
-    res = supabase.table("grading_samples").insert(payload).execute()
-    return (res.data or [None])[0]
-
-def list_grading_samples(teacher_id: str, rubric_id: Optional[str] = None,
-                         assignment_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
-    q = (supabase.table("grading_samples").select("*").eq("teacher_id", teacher_id)
-         .order("created_at", desc=True).limit(limit))
-    if rubric_id:
-        q = q.eq("rubric_id", rubric_id)
-    if assignment_id:
-        q = q.eq("assignment_id", assignment_id)
-    res = q.execute()
-    return res.data or []
-
 # =========================
 # === Activity Logging  ===
 # =========================
 
-def log_activity(user_id: str, event_type: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+def log_activity(user_id: str, event_type: str, payload: Optional[Dict[str, Any]] = None,
+                 sync: bool = False) -> Dict[str, Any]:
     """
-    Append a single event to user_activity_log.
+    Append a single event to user_activity_log: telemetry, so it is queued and bulk-inserted under the
+    caller's access token unless sync=True (or no session is set, where it is written right away).
     event_type examples:
       'writing_submitted', 'flow_burst_submitted', 'gradesim_selftest_run',
       'rubric_created', 'assignment_created', 'gradesim_anchor_added'
@@ -711,13 +1007,19 @@ def log_activity(user_id: str, event_type: str, payload: Optional[Dict[str, Any]
         "event_type": event_type,
         "event_payload": payload or {},
     }
+    token = None if sync else _access_token()
+    if token:
+        _ACTIVITY_BATCHER.enqueue(token, rec)
+        return rec
     res = supabase.table("user_activity_log").insert(rec).execute()
     return (res.data or [None])[0]
 
-def list_activity(user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+def list_activity(user_id: str, limit: int = 100,
+                  fields: Sequence[str] = ("event_type", "created_at")) -> List[Dict[str, Any]]:
+    """Recent events, newest first; pass fields=("*",) for the full rows including event_payload."""
     res = (
         supabase.table("user_activity_log")
-        .select("*")
+        .select(", ".join(fields))
         .eq("user_id", user_id)
         .order("created_at", desc=True)
         .limit(limit)
@@ -728,50 +1030,32 @@ def list_activity(user_id: str, limit: int = 100) -> List[Dict[str, Any]]:
 def activity_streak_days(user_id: str) -> int:
     """
     Simple daily streak from user_activity_log.
-    Counts consecutive days (including today) with >=1 event.
+    Counts consecutive days (including today) with >=1 event; computed server-side (activity_streak_days RPC).
     """
-    # Pull last 60 days of events
-    since = (datetime.now(timezone.utc) - timedelta(days=60)).isoformat()
-    res = (
-        supabase.table("user_activity_log")
-        .select("created_at")
-        .eq("user_id", user_id)
-        .gte("created_at", since)
-        .order("created_at", desc=True)
-        .limit(1000)
-        .execute()
-    )
-    rows = res.data or []
-    if not rows:
-        return 0
-
-    # Build set of date strings in local UTC-day (naive)
-    days = set(r["created_at"][:10] for r in rows)  # 'YYYY-MM-DD'
-    today = datetime.now(timezone.utc).date()
-    streak = 0
-    d = today
-    while d.strftime("%Y-%m-%d") in days:
-        streak += 1
-        d = d - timedelta(days=1)
-    return streak
+    if pg.enabled():
+        try:
+            return pg.run(pg.activity_streak_days(user_id))
+        except Exception:
+            pass  # fall back to PostgREST
+    return supabase.rpc("activity_streak_days", {"uid": user_id}).execute().data or 0
 
 # =========================
 # === Quick Aggregates  ===
 # =========================
 
 def count_flow_attempts(user_id: str) -> int:
-    res = supabase.table("flow_attempts").select("id", count="exact").eq("user_id", user_id).execute()
+    res = supabase.table("flow_attempts").select("id", count="estimated", head=True).eq("user_id", user_id).execute()
     return res.count or 0
 
 def count_flow_sessions(user_id: str) -> int:
-    res = supabase.table("flow_sessions").select("id", count="exact").eq("user_id", user_id).execute()
+    res = supabase.table("flow_sessions").select("id", count="estimated", head=True).eq("user_id", user_id).execute()
     return res.count or 0
 
 def count_gradesim_selftests(user_id: str) -> int:
     # We log self-tests into user_activity_log with event_type='gradesim_selftest_run'
     res = (
         supabase.table("user_activity_log")
-        .select("id", count="exact")
+        .select("id", count="estimated", head=True)
         .eq("user_id", user_id)
         .eq("event_type", "gradesim_selftest_run")
         .execute()
@@ -781,55 +1065,36 @@ def count_gradesim_selftests(user_id: str) -> int:
 def get_user_overview(user_id: str) -> Dict[str, Any]:
     """
     One-shot “omniscient” snapshot the AI can use before giving feedback.
-    Extend as needed.
+    Extend as needed (in the user_overview RPC: counts and streak are computed in one server-side call).
     """
     try:
-        return {
-            "writings_count": count_writings(user_id),
-            "flow_sessions_count": count_flow_sessions(user_id),
-            "flow_attempts_count": count_flow_attempts(user_id),
-            "gradesim_selftests_count": count_gradesim_selftests(user_id),
-            "streak_days": activity_streak_days(user_id),
-        }
+        if pg.enabled():
+            try:
+                return pg.run(pg.user_overview(user_id))
+            except Exception:
+                pass  # fall back to PostgREST
+        return supabase.rpc("user_overview", {"uid": user_id}).execute().data or {}
     except Exception:
         # Never block feedback if an aggregate fails
         return {}
 
 def get_user_context_pack(user_id: str, k_recent: int = 5) -> Dict[str, Any]:
-    """A compact, always-available bundle the AI can read before responding."""
-    from typing import cast
-    # counts & streak
-    overview = get_user_overview(user_id)
-    # recent writings (ids + short excerpts)
-    w = (
-        supabase.table("writings")
-        .select("id, created_at, title, text")
-        .eq("user_id", user_id)
-        .order("created_at", desc=True)
-        .limit(k_recent)
-        .execute()
-        .data or []
-    )
-    recent_samples = []
-    for row in w:
-        txt = (row.get("text") or "").strip()
-        if len(txt) > 400: txt = txt[:400] + "…"
-        recent_samples.append({"id": row["id"], "title": row.get("title"), "excerpt": txt})
-
-    # latest style profile & traits if present
-    profile = get_style_profile(user_id) or {}
-    # recent micro-signals from FlowState
-    fm = list_flow_recent_metrics(user_id, limit=10)
-    goals = [g.get("focus") for g in (active_flow_goals(user_id) or [])]
-
-    return {
-        "overview": overview,                      # counts, streak
-        "style_profile": {
-            "summary": profile.get("summary"),
-            "traits": profile.get("traits") or {},
-            "last_updated": profile.get("last_updated"),
-        },
-        "recent_samples": recent_samples,          # last few excerpts
-        "flow_metrics_recent": fm,                 # last N attempts metrics
-        "active_goals": goals,                     # playfulness/clarity/creativity
-    }
+    """
+    A compact, always-available bundle the AI can read before responding, built server-side by the
+    user_context_pack RPC in one round trip:
+    - overview: counts, streak
+    - style_profile: summary, traits, last_updated
+    - recent_samples: last k_recent writings as {id, title, excerpt} (excerpt capped at 400 chars)
+    - flow_metrics_recent: last 10 FlowState metric rows (FLOW_METRIC_FIELDS)
+    - active_goals: focus names (playfulness/clarity/creativity)
+    Returns {} if the call fails, so feedback is never blocked on it.
+    """
+    try:
+        if pg.enabled():
+            try:
+                return pg.run(pg.user_context_pack(user_id, k_recent)) or {}
+            except Exception:
+                pass  # fall back to PostgREST
+        return supabase.rpc("user_context_pack", {"uid": user_id, "k": k_recent}).execute().data or {}
+    except Exception:
+        return {}
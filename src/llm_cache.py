@@ -0,0 +1,297 @@
+# src/llm_cache.py
+import os
+import json
+import time
+import sqlite3
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+# ==========================================================
+# Semantic (near-duplicate) response cache
+# ==========================================================
+
+class SemanticCache:
+    """
+    MeanCache-style cache for LLM responses.
+    Entries are grouped by a partition key (e.g. style-summary hash, goal tuple) so a hit can only
+    come from the same context; within a partition the closest cached prompt embedding wins if its
+    cosine similarity clears `threshold`.
+    - embed / aembed: text -> embedding vector (sync and async flavours)
+    - ttl: seconds an entry stays valid
+    - max_entries: per-partition cap (oldest evicted first)
+    - max_partitions: LRU cap on the number of partitions held
+    """
+
+    def __init__(
+        self,
+        embed: Callable[[str], List[float]],
+        aembed: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+        threshold: float = 0.93,
+        ttl: float = 3600.0,
+        max_entries: int = 256,
+        max_partitions: int = 1024,
+    ):
+        self.embed = embed
+        self.aembed = aembed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_partitions = max_partitions
+        self._parts: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vec: List[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def lookup(self, partition: Hashable, vec: np.ndarray) -> Optional[Any]:
+        """Return the cached value most similar to `vec` in `partition`, or None."""
+        with self._lock:
+            part = self._parts.get(partition)
+            if part is None:
+                return None
+            self._parts.move_to_end(partition)
+            self._expire(part)
+            if not part["values"]:
+                return None
+            sims = part["embs"] @ vec  # one vectorized pass over every cached prompt
+            best = int(np.argmax(sims))
+            if float(sims[best]) < self.threshold:
+                return None
+            return part["values"][best]
+
+    def store(self, partition: Hashable, vec: np.ndarray, value: Any) -> None:
+        with self._lock:
+            part = self._parts.get(partition)
+            if part is None:
+                part = {"embs": np.empty((0, vec.shape[0]), dtype=np.float32), "values": [], "ts": []}
+                self._parts[partition] = part
+                while len(self._parts) > self.max_partitions:
+                    self._parts.popitem(last=False)
+            self._parts.move_to_end(partition)
+            part["embs"] = np.vstack([part["embs"], vec[None, :]])[-self.max_entries:]
+            part["values"] = (part["values"] + [value])[-self.max_entries:]
+            part["ts"] = (part["ts"] + [time.monotonic()])[-self.max_entries:]
+
+    def _expire(self, part: Dict[str, Any]) -> None:
+        cutoff = time.monotonic() - self.ttl
+        keep = [i for i, t in enumerate(part["ts"]) if t >= cutoff]
+        if len(keep) != len(part["ts"]):
+            part["embs"] = part["embs"][keep]
+            part["values"] = [part["values"][i] for i in keep]
+            part["ts"] = [part["ts"][i] for i in keep]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._parts.clear()
+
+    def wrap(self, partition: Callable[[Dict[str, Any]], Hashable], text_arg: str = "text"):
+        """
+        Decorator: embed the wrapped function's `text_arg`, serve a near-duplicate hit from the cache,
+        otherwise call through and remember the result. Works on plain and async functions.
+        - partition: receives the bound call arguments (name -> value) and returns the partition key
+        Embedding failures skip the cache rather than failing the call; exceptions from the wrapped
+        function propagate and are never cached.
+        """
+        def decorator(fn):
+            sig = inspect.signature(fn)
+
+            def _key_and_text(args, kwargs):
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return partition(bound.arguments), bound.arguments[text_arg] or ""
+
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    part, text = _key_and_text(args, kwargs)
+                    try:
+                        vec = self._unit(await self.aembed(text)) if self.aembed else self._unit(self.embed(text))
+                    except Exception:
+                        return await fn(*args, **kwargs)
+                    hit = self.lookup(part, vec)
+                    if hit is not None:
+                        return hit
+                    value = await fn(*args, **kwargs)
+                    self.store(part, vec, value)
+                    return value
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                part, text = _key_and_text(args, kwargs)
+                try:
+                    vec = self._unit(self.embed(text))
+                except Exception:
+                    return fn(*args, **kwargs)
+                hit = self.lookup(part, vec)
+                if hit is not None:
+                    return hit
+                value = fn(*args, **kwargs)
+                self.store(part, vec, value)
+                return value
+            return wrapper
+
+        return decorator
+
+# ==========================================================
+# Exact-match response cache
+# ==========================================================
+
+class ExactCache:
+    """
+    TTL + LRU cache for byte-identical calls (re-submits, dev reloads). Meant to sit in front of a
+    SemanticCache so an exact repeat skips the embedding round trip as well as the completion.
+    - maxsize: entries kept (least recently used evicted first)
+    - ttl: seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 1800.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            ts, value = hit
+            if time.monotonic() - ts > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def wrap(self, key: Callable[[Dict[str, Any]], Optional[Hashable]]):
+        """
+        Decorator for plain and async functions.
+        - key: receives the bound call arguments and returns the cache key (None = don't cache this call)
+        Exceptions from the wrapped function propagate and are never cached.
+        """
+        def decorator(fn):
+            sig = inspect.signature(fn)
+
+            def _key(args, kwargs):
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                return key(bound.arguments)
+
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    k = _key(args, kwargs)
+                    hit = self.get(k) if k is not None else None
+                    if hit is not None:
+                        return hit
+                    value = await fn(*args, **kwargs)
+                    if k is not None:
+                        self.set(k, value)
+                    return value
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                k = _key(args, kwargs)
+                hit = self.get(k) if k is not None else None
+                if hit is not None:
+                    return hit
+                value = fn(*args, **kwargs)
+                if k is not None:
+                    self.set(k, value)
+                return value
+            return wrapper
+
+        return decorator
+
+# ==========================================================
+# On-disk response cache
+# ==========================================================
+
+class DiskCache:
+    """
+    SQLite-backed key -> JSON cache with a TTL; survives restarts and is shared by worker processes.
+    Keys should be content hashes of the full request, so an edited rubric or essay simply misses.
+    Any storage error (read-only disk, locked file) degrades to a miss instead of failing the call.
+    - path: database file (parent directories are created on first use)
+    - ttl: seconds an entry stays valid
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 86400.0):
+        self.path = path
+        self.ttl = ttl
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            with self._lock:
+                row = self._db().execute("SELECT value, ts FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        try:
+            with self._lock:
+                conn = self._db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, ts) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+                conn.commit()
+        except (sqlite3.Error, TypeError, ValueError):
+            pass
+
+    def invalidate(self, key: str) -> None:
+        try:
+            with self._lock:
+                conn = self._db()
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def clear(self) -> None:
+        try:
+            with self._lock:
+                conn = self._db()
+                conn.execute("DELETE FROM llm_cache")
+                conn.commit()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,157 @@
+# src/pg.py
+# Direct asyncpg reads for the hot paths. This connection does NOT go through PostgREST, so RLS is
+# bypassed: every helper takes the user id and scopes its query by it (an empty id raises).
+import os
+import json
+import asyncio
+import threading
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, TypeVar
+from urllib.parse import urlparse
+
+try:
+    import asyncpg
+except Exception:
+    asyncpg = None
+
+# Deployed environments inject the URL directly; only read .env (local dev) when it is missing.
+if os.getenv("SUPABASE_DB_URL") is None:
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Direct Postgres connection string (Supabase: Project Settings -> Database). Unset = stay on PostgREST.
+DATABASE_URL = os.getenv("SUPABASE_DB_URL")
+# Supavisor/pgbouncer transaction mode (port 6543) cannot keep prepared statements across transactions.
+_TRANSACTION_POOLER = (
+    os.getenv("SUPABASE_DB_POOL_MODE", "").lower() == "transaction"
+    or (DATABASE_URL is not None and urlparse(DATABASE_URL).port == 6543)
+)
+
+# Kept small by default: each Streamlit process holds its own pool, and Supabase plans cap connections
+_POOL_MIN = int(os.getenv("SUPABASE_DB_POOL_MIN", "1"))
+_POOL_MAX = int(os.getenv("SUPABASE_DB_POOL_MAX", "10"))
+
+T = TypeVar("T")
+
+def enabled() -> bool:
+    """True when the asyncpg fast path is usable (driver installed and SUPABASE_DB_URL set)."""
+    return asyncpg is not None and bool(DATABASE_URL)
+
+# ==========================================================
+# Pool + loop
+# ==========================================================
+# Streamlit reruns are synchronous, so the pool lives on one background event loop and callers
+# hand it coroutines through run(). One loop means one pool for the whole process.
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_POOL: Optional["asyncpg.Pool"] = None
+_LOCK = threading.Lock()
+_POOL_LOCK = asyncio.Lock()  # only ever awaited on the pool's loop
+
+def _loop() -> asyncio.AbstractEventLoop:
+    global _LOOP
+    with _LOCK:
+        if _LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="pg-loop", daemon=True).start()
+            _LOOP = loop
+    return _LOOP
+
+async def _init_conn(conn) -> None:
+    # Decode json/jsonb to Python objects so results look like PostgREST's
+    for typ in ("json", "jsonb"):
+        await conn.set_type_codec(typ, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+async def get_pool() -> "asyncpg.Pool":
+    global _POOL
+    if _POOL is None:
+        async with _POOL_LOCK:
+            if _POOL is None:  # concurrent first callers wait here instead of each creating a pool
+                _POOL = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=_POOL_MIN,
+                    max_size=max(_POOL_MAX, _POOL_MIN),
+                    max_queries=50_000,
+                    max_inactive_connection_lifetime=300,
+                    statement_cache_size=0 if _TRANSACTION_POOLER else 100,
+                    init=_init_conn,
+                )
+    return _POOL
+
+def run(coro: Awaitable[T], timeout: float = 10.0) -> T:
+    """Run a coroutine on the pool's loop from synchronous code and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop()).result(timeout)
+
+async def _val(sql: str, *args) -> Any:
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        return await conn.fetchval(sql, *args)
+
+# ==========================================================
+# Hot reads
+# ==========================================================
+# This connection bypasses RLS, so every query scopes by user id explicitly (_uid refuses an empty
+# one rather than run unscoped). Rows are built with
+# to_json server-side: one value per query, with the same keys (in column order) and ISO timestamps
+# that PostgREST returns.
+
+def _uid(user_id: str) -> str:
+    if not user_id:
+        raise ValueError("pg helpers bypass RLS and need the user id to scope the query")
+    return user_id
+
+async def user_overview(user_id: str) -> Dict[str, Any]:
+    return await _val("select public.user_overview($1::uuid)", _uid(user_id)) or {}
+
+async def activity_streak_days(user_id: str) -> int:
+    return int(await _val("select public.activity_streak_days($1::uuid)", _uid(user_id)) or 0)
+
+async def flow_metric_baseline(user_id: str, metric_field: str, days: int = 7) -> Optional[float]:
+    return await _val("select public.flow_metric_baseline($1::uuid, $2, $3)", _uid(user_id), metric_field, days)
+
+async def flow_metric_baselines(user_id: str, metric_fields: List[str], days: int = 7) -> Dict[str, Optional[float]]:
+    return await _val("select public.flow_metric_baselines($1::uuid, $2, $3)", _uid(user_id), metric_fields, days) or {}
+
+async def list_writings(user_id: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    # limit null = no limit
+    return await _val(
+        """
+        select coalesce(json_agg(json_build_object('id', w.id, 'title', w.title, 'created_at', w.created_at)
+                                  order by w.created_at desc), '[]'::json)
+        from (
+            select id, title, created_at
+            from public.writings
+            where user_id = $1::uuid
+            order by created_at desc
+            limit $2 offset $3
+        ) w
+        """,
+        _uid(user_id), limit, offset,
+    )
+
+def _columns(fields: Sequence[str]) -> str:
+    """Comma-separated column list with every name quoted as an identifier ("*" passes through)."""
+    return ", ".join(f if f == "*" else '"' + f.replace('"', '""') + '"' for f in fields)
+
+async def list_flow_recent_metrics(user_id: str, limit: int = 10, fields: Sequence[str] = ("*",)) -> List[Dict[str, Any]]:
+    # created_at is always selected for the ordering; drop it again if the caller did not ask for it
+    cols = _columns(tuple(fields) if "created_at" in fields or "*" in fields else (*fields, "created_at"))
+    rows = await _val(
+        f"""
+        select coalesce(json_agg(to_json(m) order by m.created_at desc), '[]'::json)
+        from (
+            select {cols}
+            from public.flow_metrics
+            where user_id = $1::uuid
+            order by created_at desc
+            limit $2
+        ) m
+        """,
+        _uid(user_id), limit,
+    )
+    if "created_at" not in fields and "*" not in fields:
+        for r in rows:
+            r.pop("created_at", None)
+    return rows
+
+async def user_context_pack(user_id: str, k_recent: int = 5) -> Dict[str, Any]:
+    return await _val("select public.user_context_pack($1::uuid, $2)", _uid(user_id), k_recent)
@@ -1,51 +1,134 @@
 import json
 import os
+import hashlib
+import sqlite3
+import threading
 
-PROFILE_PATH = "data/user_profile.json"
+# orjson is a much faster encoder/decoder; stdlib json stays as the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PROFILE_PATH = "data/user_profile.json"  # legacy store, imported once into the database below
+PROFILE_DB_PATH = "data/profile.sqlite3"
+
+_COLUMNS = ("count", "avg_sentence_length", "vocab_richness", "frequent_words")
+TOP_WORDS = 200  # frequent_words keeps the TOP_WORDS most seen words as {"word": times_seen}
+
+_conn = None
+_lock = threading.Lock()
+
+def _dumps(obj) -> str:
+    """Compact JSON with sorted keys (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS, default=str).decode()
+    return json.dumps(obj, sort_keys=True, default=str)
+
+def _loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def _db():
+    """Open (once) the single-row profile database in WAL mode, importing the legacy JSON file if present."""
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(PROFILE_DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(PROFILE_DB_PATH, check_same_thread=False, timeout=5.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS profile ("
+            " id INTEGER PRIMARY KEY CHECK (id = 1),"
+            " count INTEGER NOT NULL DEFAULT 0,"
+            " avg_sentence_length REAL NOT NULL DEFAULT 0,"
+            " vocab_richness REAL NOT NULL DEFAULT 0,"
+            " frequent_words TEXT NOT NULL DEFAULT '{}',"
+            " last_hash BLOB)"
+        )
+        if "last_hash" not in {r[1] for r in conn.execute("PRAGMA table_info(profile)")}:
+            conn.execute("ALTER TABLE profile ADD COLUMN last_hash BLOB")
+        # Earlier rows stored frequent_words as a plain list: count each word once
+        conn.execute(
+            "UPDATE profile SET frequent_words ="
+            " (SELECT json_group_object(value, 1) FROM json_each(profile.frequent_words))"
+            " WHERE json_type(frequent_words) = 'array'"
+        )
+        if conn.execute("SELECT 1 FROM profile").fetchone() is None and os.path.exists(PROFILE_PATH):
+            with open(PROFILE_PATH, "rb") as f:
+                _write(conn, _loads(f.read()))
+        conn.commit()
+        _conn = conn
+    return _conn
+
+def _write(conn, profile):
+    words = profile.get("frequent_words") or {}
+    if isinstance(words, list):
+        words = dict.fromkeys(words, 1)
+    conn.execute(
+        "INSERT OR REPLACE INTO profile (id, count, avg_sentence_length, vocab_richness, frequent_words)"
+        " VALUES (1, ?, ?, ?, ?)",
+        (
+            profile.get("count", 0),
+            profile.get("avg_sentence_length", 0),
+            profile.get("vocab_richness", 0),
+            _dumps(words),
+        ),
+    )
+
+def _row_to_profile(row):
+    if row is None:
+        return {}
+    profile = dict(zip(_COLUMNS, row))
+    profile["frequent_words"] = _loads(profile["frequent_words"])
+    return profile
 
 def load_profile():
-    """Load user profile metrics from JSON (if exists)."""
-    if os.path.exists(PROFILE_PATH):
-        with open(PROFILE_PATH, "r") as f:
-            return json.load(f)
-    return {}
+    """Load user profile metrics (empty dict if nothing stored yet)."""
+    with _lock:
+        row = _db().execute(f"SELECT {', '.join(_COLUMNS)} FROM profile WHERE id = 1").fetchone()
+    return _row_to_profile(row)
 
 def save_profile(profile):
-    """Save user profile metrics to JSON."""
-    os.makedirs("data", exist_ok=True)
-    with open(PROFILE_PATH, "w") as f:
-        json.dump(profile, f, indent=2)
+    """Replace the stored profile metrics."""
+    with _lock:
+        conn = _db()
+        _write(conn, profile)
+        conn.commit()
 
 def update_profile(new_metrics):
     """
-    Merge new metrics into profile:
-    - Maintain running average for quantitative metrics.
-    - Append frequent words for tracking evolution.
+    Merge new metrics into profile with one UPDATE (no read-modify-write in Python):
+    - Maintain running average for quantitative metrics (Welford-style incremental mean).
+    - Count frequent words across entries, keeping only the TOP_WORDS most seen.
+    Metrics identical to the previous call (same hash) are a no-op: nothing is written and count stays.
     """
-    profile = load_profile()
-
-    # Initialize if empty
-    if not profile:
-        profile = {
-            "count": 0,
-            "avg_sentence_length": 0,
-            "vocab_richness": 0,
-            "frequent_words": []
-        }
-
-    count = profile["count"] + 1
-    profile["count"] = count
-
-    # Running averages
-    profile["avg_sentence_length"] = (
-        (profile["avg_sentence_length"] * (count - 1) + new_metrics["sentence_length_avg"]) / count
-    )
-    profile["vocab_richness"] = (
-        (profile["vocab_richness"] * (count - 1) + new_metrics["vocab_richness"]) / count
-    )
-
-    # Update frequent words (basic merge)
-    profile["frequent_words"] = list(set(profile["frequent_words"] + new_metrics["frequent_words"]))
-
-    save_profile(profile)
-    return profile
+    digest = hashlib.blake2b(_dumps(new_metrics).encode("utf-8"), digest_size=8).digest()
+    with _lock:
+        conn = _db()
+        conn.execute("INSERT OR IGNORE INTO profile (id) VALUES (1)")
+        # SET expressions see the pre-update row, so `count` below is the old count
+        row = conn.execute(
+            "UPDATE profile SET"
+            " count = count + 1,"
+            " avg_sentence_length = avg_sentence_length + (? - avg_sentence_length) / (count + 1),"
+            " vocab_richness = vocab_richness + (? - vocab_richness) / (count + 1),"
+            " frequent_words = (SELECT json_group_object(w, n) FROM ("
+            "   SELECT w, sum(n) AS n FROM ("
+            "     SELECT key AS w, value AS n FROM json_each(profile.frequent_words)"
+            "     UNION ALL SELECT value, 1 FROM json_each(?))"
+            "   GROUP BY w ORDER BY n DESC, w LIMIT ?)),"
+            " last_hash = ?"
+            f" WHERE id = 1 AND last_hash IS NOT ? RETURNING {', '.join(_COLUMNS)}",
+            (
+                new_metrics["sentence_length_avg"],
+                new_metrics["vocab_richness"],
+                _dumps(new_metrics["frequent_words"]),
+                TOP_WORDS,
+                digest,
+                digest,
+            ),
+        ).fetchone()
+        conn.commit()
+    if row is None:  # same metrics as last time
+        return load_profile()
+    return _row_to_profile(row)
@@ -1,6 +1,8 @@
 # src/supabase_client.py
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 import os
+import threading
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,4 +13,35 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
 if not SUPABASE_URL or not SUPABASE_ANON_KEY:
     raise RuntimeError("Missing SUPABASE_URL or SUPABASE_ANON_KEY in environment")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
+# One keep-alive HTTP/2 pool for every PostgREST call: a Streamlit rerun issues several queries
+# back-to-back, and this pays the TLS handshake once instead of per request.
+# The pool lives on the transport (a client ignores its own limits once given one); retries=3 only
+# re-attempts failed connects, so a request that reached PostgREST is never sent twice.
+_HTTP = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60),
+        retries=3,
+    ),
+    timeout=10.0,
+)
+
+try:
+    _OPTIONS = ClientOptions(postgrest_client_timeout=10, httpx_client=_HTTP)
+except TypeError:
+    # supabase-py releases before httpx_client injection: keep the library's own transport
+    _OPTIONS = ClientOptions(postgrest_client_timeout=10)
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY, options=_OPTIONS)
+
+
+def _warm() -> None:
+    # Opens the first pooled connection (DNS + TLS + HTTP/2 setup) so the first real query doesn't pay for it
+    try:
+        supabase.table("profiles").select("id").limit(1).execute()
+    except Exception:
+        pass  # best effort: the first real query will simply connect itself
+
+# Off with SUPABASE_DB_POOL_WARM=0. Runs in the background so import (and Streamlit startup) never waits on it.
+if os.getenv("SUPABASE_DB_POOL_WARM", "1").lower() not in ("0", "false", "no"):
+    threading.Thread(target=_warm, name="supabase-warmup", daemon=True).start()
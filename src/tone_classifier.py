@@ -1,41 +1,66 @@
 import os
+import hashlib
 from dotenv import load_dotenv
 
-# Optional: use OpenAI if key present
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
+from .llm_cache import ExactCache
 
 load_dotenv()
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 
+_CLIENT = None
+# Model labels by content hash: re-classifying the same text (reruns, re-submits) skips the API
+_TONE_CACHE = ExactCache(maxsize=4096, ttl=86400)
+
+def _client():
+    """
+    Shared client, built on first use and reused so later calls ride the same keep-alive connections.
+    The SDK is imported here, not at module load, so installs without a key never pay for it.
+    Returns None if the openai package is missing.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        try:
+            from openai import OpenAI
+        except ImportError:
+            return None
+        _CLIENT = OpenAI(api_key=OPENAI_KEY)
+    return _CLIENT
+
 def classify_tone(text: str) -> str:
     """
     Classify tone using OpenAI (if key provided) or fallback heuristic.
     """
-    if OPENAI_KEY and OpenAI:
-        try:
-            client = OpenAI(api_key=OPENAI_KEY)
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Classify tone in one or two words (e.g., reflective, casual, formal)."},
-                    {"role": "user", "content": text}
-                ]
-            )
-            return response.choices[0].message["content"].strip().lower()
-        except Exception:
-            return _fallback_tone(text)
-    else:
+    if not OPENAI_KEY:
+        return _fallback_tone(text)
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+    hit = _TONE_CACHE.get(key)
+    if hit is not None:
+        return hit
+    client = _client()
+    if client is None:
+        return _fallback_tone(text)
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": "Classify tone in one or two words (e.g., reflective, casual, formal)."},
+                {"role": "user", "content": text}
+            ]
+        )
+        tone = (response.choices[0].message.content or "").strip().lower()
+    except Exception:
+        return _fallback_tone(text)
+    if not tone:
         return _fallback_tone(text)
+    _TONE_CACHE.set(key, tone)
+    return tone
 
 def _fallback_tone(text: str) -> str:
     if "!" in text:
         return "energetic"
     elif "?" in text:
         return "inquisitive"
-    elif text.lower().startswith(("dear", "to whom")):
+    elif text[:8].lower().startswith(("dear", "to whom")):  # only the prefix matters; don't lowercase it all
         return "formal"
     else:
         return "neutral"
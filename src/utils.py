@@ -1,8 +1,15 @@
-import re
+import functools
+
+# Token-aware truncation when tiktoken is available; character caps otherwise
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 def clean_text(text: str) -> str:
     """Basic cleaning: strip extra spaces, normalize whitespace."""
-    return re.sub(r'\s+', ' ', text).strip()
+    # str.split() and re's \s agree on what whitespace is, so this equals re.sub(r'\s+', ' ', text).strip()
+    return " ".join(text.split())
 
 def tokenize_words(doc):
     """Return lowercase alpha tokens from spaCy doc."""
@@ -11,3 +18,28 @@ def tokenize_words(doc):
 def filter_stopwords(words, stopwords):
     """Remove stopwords from token list."""
     return [w for w in words if w not in stopwords]
+
+@functools.lru_cache(maxsize=1)
+def get_encoder():
+    """Tokenizer shared by the gpt-4o family; None if tiktoken or its BPE file is unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+def count_tokens(text: str) -> int:
+    """Token count for the gpt-4o family, estimated at ~4 chars/token without tiktoken."""
+    enc = get_encoder()
+    return len(enc.encode(text, disallowed_special=())) if enc is not None else len(text) // 4
+
+def truncate_tokens(text: str, max_tokens: int, ellipsis: str = "…") -> str:
+    """Cap text by tokens (what the model bills and prefills), falling back to ~4 chars/token."""
+    text = (text or "").strip()
+    enc = get_encoder()
+    if enc is None:
+        max_chars = max_tokens * 4
+        return text if len(text) <= max_chars else text[:max_chars] + ellipsis
+    ids = enc.encode(text, disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max_tokens]) + ellipsis
@@ -0,0 +1,14 @@
+-- Composite indexes matching the .eq(<owner>).order("created_at", desc) list queries in src/db.py,
+-- so per-user / per-writing lists are served by an index scan in the requested order.
+
+create index if not exists writings_user_created_idx
+    on public.writings (user_id, created_at desc);
+
+create index if not exists style_snapshots_user_created_idx
+    on public.style_snapshots (user_id, created_at desc);
+
+create index if not exists writing_insights_writing_created_idx
+    on public.writing_insights (writing_id, created_at desc);
+
+create index if not exists companion_feedback_writing_created_idx
+    on public.companion_feedback (writing_id, created_at desc);
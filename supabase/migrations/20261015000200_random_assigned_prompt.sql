@@ -0,0 +1,28 @@
+-- Pick one active prompt linked to an assignment server-side: one round trip returning one row,
+-- instead of fetching every linked prompt and choosing in Python.
+-- Returns the same flattened shape as db.list_prompts_for_assignment (prompt fields + link_id, sort),
+-- or null when the assignment has no active prompts. volatile, not stable: random() must be drawn
+-- on every call, never folded or reused within a statement. Runs as the caller, so RLS still applies.
+
+create or replace function public.random_assigned_prompt(aid uuid)
+returns jsonb
+language sql
+volatile
+as $$
+    select jsonb_build_object(
+        'id', fp.id,
+        'text', fp.text,
+        'tags', fp.tags,
+        'level', fp.level,
+        'active', fp.active,
+        'teacher_id', fp.teacher_id,
+        'link_id', a.id,
+        'sort', a.sort
+    )
+    from public.flow_prompt_assignments a
+    join public.flow_prompts fp on fp.id = a.prompt_id
+    where a.assignment_id = aid
+      and coalesce(fp.active, true)
+    order by random()
+    limit 1
+$$;
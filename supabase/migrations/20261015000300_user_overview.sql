@@ -0,0 +1,32 @@
+-- All of get_user_overview in one round trip: four counts plus the daily activity streak
+-- (consecutive UTC days, ending today, with at least one user_activity_log event in the last 60 days).
+-- Returns {"writings_count", "flow_sessions_count", "flow_attempts_count", "gradesim_selftests_count", "streak_days"}.
+
+create or replace function public.user_overview(uid uuid)
+returns jsonb
+language sql
+stable
+as $$
+    with days as (
+        select distinct (created_at at time zone 'utc')::date as d
+        from public.user_activity_log
+        where user_id = uid
+          and created_at >= now() - interval '60 days'
+    ),
+    ranked as (
+        select (now() at time zone 'utc')::date - d as days_ago,
+               row_number() over (order by d desc) - 1 as rn
+        from days
+    )
+    select jsonb_build_object(
+        'writings_count', (select count(*) from public.writings where user_id = uid),
+        'flow_sessions_count', (select count(*) from public.flow_sessions where user_id = uid),
+        'flow_attempts_count', (select count(*) from public.flow_attempts where user_id = uid),
+        'gradesim_selftests_count', (
+            select count(*) from public.user_activity_log
+            where user_id = uid and event_type = 'gradesim_selftest_run'
+        ),
+        -- a day belongs to the streak when its distance from today equals its rank
+        'streak_days', (select count(*) from ranked where days_ago = rn)
+    )
+$$;
@@ -0,0 +1,39 @@
+-- Daily activity streak as its own function (used by db.activity_streak_days and user_overview):
+-- consecutive UTC days, ending today, with at least one user_activity_log event in the last 60 days.
+
+create or replace function public.activity_streak_days(uid uuid)
+returns integer
+language sql
+stable
+as $$
+    with days as (
+        select distinct (created_at at time zone 'utc')::date as d
+        from public.user_activity_log
+        where user_id = uid
+          and created_at >= now() - interval '60 days'
+    ),
+    ranked as (
+        select (now() at time zone 'utc')::date - d as days_ago,
+               row_number() over (order by d desc) - 1 as rn
+        from days
+    )
+    -- a day belongs to the streak when its distance from today equals its rank
+    select count(*)::integer from ranked where days_ago = rn
+$$;
+
+create or replace function public.user_overview(uid uuid)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'writings_count', (select count(*) from public.writings where user_id = uid),
+        'flow_sessions_count', (select count(*) from public.flow_sessions where user_id = uid),
+        'flow_attempts_count', (select count(*) from public.flow_attempts where user_id = uid),
+        'gradesim_selftests_count', (
+            select count(*) from public.user_activity_log
+            where user_id = uid and event_type = 'gradesim_selftest_run'
+        ),
+        'streak_days', public.activity_streak_days(uid)
+    )
+$$;
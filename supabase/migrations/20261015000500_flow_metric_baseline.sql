@@ -0,0 +1,26 @@
+-- Rolling average of one flow_metrics column over the last N days (latest 200 attempts at most),
+-- aggregated in the database so a single float comes back instead of the rows.
+-- The column name is dynamic, so it is spliced in with format(%I), which quotes it as an identifier.
+-- Returns null when there is no data.
+
+create or replace function public.flow_metric_baseline(uid uuid, field text, days integer default 7)
+returns double precision
+language plpgsql
+stable
+as $$
+declare
+    result double precision;
+begin
+    execute format(
+        'select avg(v)::double precision from ('
+        '    select %I as v from public.flow_metrics'
+        '    where user_id = $1 and created_at >= now() - make_interval(days => $2)'
+        '    order by created_at desc limit 200'
+        ') s',
+        field
+    )
+    into result
+    using uid, days;
+    return result;
+end
+$$;
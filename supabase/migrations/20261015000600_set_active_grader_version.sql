@@ -0,0 +1,13 @@
+-- Switch the active grader version for a teacher/rubric in one statement: every version of the pair
+-- is rewritten to is_active = (id = vid), so there is no window with zero (or two) active versions
+-- and the app makes one round trip instead of two. Runs as the caller, so RLS still applies.
+
+create or replace function public.set_active_grader_version(tid uuid, rid uuid, vid uuid)
+returns void
+language sql
+as $$
+    update public.teacher_grader_versions
+    set is_active = (id = vid)
+    where teacher_id = tid
+      and rubric_id = rid
+$$;
@@ -0,0 +1,38 @@
+-- Create a grader version and number it in the same statement: version defaults to
+-- max(version) + 1 for the teacher/rubric pair (1 for the first), computed inside the INSERT.
+-- A transaction-scoped advisory lock on the pair serialises concurrent creates, so two callers can
+-- no longer read the same max and both insert it. Returns the inserted row.
+-- Runs as the caller, so RLS still applies.
+
+create or replace function public.create_grader_version(
+    tid uuid,
+    rid uuid,
+    method text default 'few_shot_prompt',
+    config jsonb default '{}'::jsonb,
+    train_stats jsonb default null,
+    is_active boolean default false,
+    version int default null
+)
+returns jsonb
+language sql
+as $$
+    select pg_advisory_xact_lock(hashtextextended(tid::text || ':' || rid::text, 0));
+
+    insert into public.teacher_grader_versions
+        (teacher_id, rubric_id, version, method, config, train_stats, is_active)
+    select
+        tid,
+        rid,
+        coalesce(
+            create_grader_version.version,
+            (select max(v.version) + 1
+             from public.teacher_grader_versions v
+             where v.teacher_id = tid and v.rubric_id = rid),
+            1
+        ),
+        create_grader_version.method,
+        coalesce(create_grader_version.config, '{}'::jsonb),
+        create_grader_version.train_stats,
+        create_grader_version.is_active
+    returning to_jsonb(teacher_grader_versions.*)
+$$;
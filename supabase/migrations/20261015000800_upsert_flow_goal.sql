@@ -0,0 +1,58 @@
+-- At most one active goal per (user_id, focus), enforced by a partial unique index, so
+-- upsert_flow_goal can be a single INSERT ... ON CONFLICT instead of a SELECT followed by an
+-- INSERT or UPDATE (two round trips, and two concurrent calls could both insert).
+-- PostgREST's on_conflict cannot name a partial index's predicate, hence the RPC.
+
+-- Keep only the newest active goal per (user_id, focus) before adding the constraint.
+update public.flow_goals g
+set active = false
+where g.active
+  and exists (
+      select 1 from public.flow_goals newer
+      where newer.user_id = g.user_id
+        and newer.focus = g.focus
+        and newer.active
+        and (newer.created_at, newer.id) > (g.created_at, g.id)
+  );
+
+create unique index if not exists flow_goals_user_focus_active_key
+    on public.flow_goals (user_id, focus)
+    where active;
+
+-- Same contract as the old Python helper: update the active goal for this focus if there is one,
+-- otherwise insert. active = false deactivates the current goal (or records an inactive one).
+-- Returns the written row. Runs as the caller, so RLS still applies.
+create or replace function public.upsert_flow_goal(
+    uid uuid,
+    focus text,
+    target double precision,
+    window_days integer default 14,
+    active boolean default true
+)
+returns jsonb
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    result jsonb;
+begin
+    if upsert_flow_goal.active then
+        insert into public.flow_goals as g (user_id, focus, target, window_days, active)
+        values (uid, upsert_flow_goal.focus, upsert_flow_goal.target, upsert_flow_goal.window_days, true)
+        on conflict (user_id, focus) where active
+        do update set target = excluded.target, window_days = excluded.window_days
+        returning to_jsonb(g.*) into result;
+    else
+        update public.flow_goals as g
+        set target = upsert_flow_goal.target, window_days = upsert_flow_goal.window_days, active = false
+        where g.user_id = uid and g.focus = upsert_flow_goal.focus and g.active
+        returning to_jsonb(g.*) into result;
+        if result is null then
+            insert into public.flow_goals as g (user_id, focus, target, window_days, active)
+            values (uid, upsert_flow_goal.focus, upsert_flow_goal.target, upsert_flow_goal.window_days, false)
+            returning to_jsonb(g.*) into result;
+        end if;
+    end if;
+    return result;
+end
+$$;
@@ -0,0 +1,43 @@
+-- Composite indexes for the remaining .eq(<owner>).order("created_at", desc).limit(n) list queries
+-- (and the per-user counts), so they are answered by an index range scan already in the requested
+-- order instead of a sequential scan plus sort once the tables grow.
+-- Plain create index like 20261015000100: migrations run in a transaction, where CONCURRENTLY is
+-- not allowed. On a large live table, run the statement by hand with CONCURRENTLY first; the
+-- if not exists then makes this migration a no-op.
+
+create index if not exists flow_metrics_user_created_idx
+    on public.flow_metrics (user_id, created_at desc);
+
+create index if not exists flow_attempts_user_created_idx
+    on public.flow_attempts (user_id, created_at desc);
+
+create index if not exists flow_sessions_user_created_idx
+    on public.flow_sessions (user_id, created_at desc);
+
+-- list_activity / the streak (user_id, created_at) and count_gradesim_selftests (user_id, event_type)
+create index if not exists user_activity_log_user_created_idx
+    on public.user_activity_log (user_id, created_at desc);
+
+create index if not exists user_activity_log_user_event_created_idx
+    on public.user_activity_log (user_id, event_type, created_at desc);
+
+create index if not exists flow_prompts_teacher_created_idx
+    on public.flow_prompts (teacher_id, created_at desc);
+
+create index if not exists rubrics_teacher_archived_created_idx
+    on public.rubrics (teacher_id, archived, created_at desc);
+
+create index if not exists assignments_teacher_created_idx
+    on public.assignments (teacher_id, created_at desc);
+
+create index if not exists grading_samples_teacher_created_idx
+    on public.grading_samples (teacher_id, created_at desc);
+
+create index if not exists teacher_grader_versions_teacher_rubric_version_idx
+    on public.teacher_grader_versions (teacher_id, rubric_id, version desc);
+
+create index if not exists grade_requests_teacher_created_idx
+    on public.grade_requests (teacher_id, created_at desc);
+
+create index if not exists grade_requests_student_created_idx
+    on public.grade_requests (student_id, created_at desc);
@@ -0,0 +1,65 @@
+-- The whole Context Pack (see db.get_user_context_pack) in one call: overview counts and streak,
+-- style profile, the k most recent writing excerpts, the last 10 FlowState metrics and the active
+-- goal foci, assembled as one json value instead of five PostgREST round trips. json rather than
+-- jsonb keeps the keys in the order the Python pack used, so the serialized prompt is unchanged.
+-- Excerpts are trimmed and cut at 400 characters with a trailing ellipsis, as the Python code did.
+-- Runs as the caller, so RLS still applies.
+
+create or replace function public.user_context_pack(uid uuid, k integer default 5)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'overview', public.user_overview(uid),
+        'style_profile', (
+            select json_build_object(
+                'summary', sp.summary,
+                'traits', coalesce(sp.traits, '{}'::jsonb),
+                'last_updated', sp.last_updated
+            )
+            from (select 1) one
+            left join public.style_profiles sp on sp.user_id = uid
+            limit 1
+        ),
+        'recent_samples', (
+            select coalesce(json_agg(json_build_object(
+                       'id', w.id,
+                       'title', w.title,
+                       'excerpt', case when length(w.body) > 400 then left(w.body, 400) || '…' else w.body end
+                   ) order by w.created_at desc), '[]'::json)
+            from (
+                select id, title, created_at,
+                       regexp_replace(coalesce(text, ''), '^\s+|\s+$', '', 'g') as body
+                from public.writings
+                where user_id = uid
+                order by created_at desc
+                limit k
+            ) w
+        ),
+        'flow_metrics_recent', (
+            select coalesce(json_agg(json_build_object(
+                       'created_at', m.created_at,
+                       'word_count', m.word_count,
+                       'wpm', m.wpm,
+                       'vocab_ttr', m.vocab_ttr,
+                       'repetition_rate', m.repetition_rate,
+                       'playfulness_score', m.playfulness_score,
+                       'clarity_score', m.clarity_score,
+                       'creativity_score', m.creativity_score,
+                       'composite_score', m.composite_score
+                   ) order by m.created_at desc), '[]'::json)
+            from (
+                select * from public.flow_metrics
+                where user_id = uid
+                order by created_at desc
+                limit 10
+            ) m
+        ),
+        'active_goals', (
+            select coalesce(json_agg(g.focus order by g.created_at desc), '[]'::json)
+            from public.flow_goals g
+            where g.user_id = uid and g.active
+        )
+    )
+$$;
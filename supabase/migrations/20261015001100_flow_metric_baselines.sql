@@ -0,0 +1,30 @@
+-- Several flow_metric_baseline averages in one call and one scan: the FlowState submit needs a
+-- baseline per selected goal, which used to be one round trip each.
+-- Same window as flow_metric_baseline (last N days, latest 200 attempts). Returns a json object
+-- field -> average (null when there is no data). Column names are quoted with format(%I).
+
+create or replace function public.flow_metric_baselines(uid uuid, fields text[], days integer default 7)
+returns jsonb
+language plpgsql
+stable
+as $$
+declare
+    result jsonb;
+begin
+    if coalesce(cardinality(fields), 0) = 0 then
+        return '{}'::jsonb;
+    end if;
+    execute format(
+        'select jsonb_build_object(%s) from ('
+        '    select %s from public.flow_metrics'
+        '    where user_id = $1 and created_at >= now() - make_interval(days => $2)'
+        '    order by created_at desc limit 200'
+        ') s',
+        (select string_agg(format('%L, avg(%I)::double precision', f, f), ', ') from unnest(fields) f),
+        (select string_agg(format('%I', f), ', ') from (select distinct unnest(fields) f) d)
+    )
+    into result
+    using uid, days;
+    return result;
+end
+$$;
@@ -0,0 +1,51 @@
+-- Record a FlowState submit (attempt, its metrics and the feedback shown) in one call and one
+-- transaction: three inserts chained through data-modifying CTEs instead of three round trips,
+-- and no attempt is left without its metrics if a later insert fails.
+-- p_metrics is a json object keyed by flow_metrics column; jsonb_populate_record casts each value
+-- to the column type. The feedback row is skipped when p_feedback is null.
+-- Returns {attempt, metrics, feedback} as rows. Runs as the caller, so RLS still applies.
+
+create or replace function public.record_flow_submit(
+    p_session uuid,
+    p_prompt uuid,
+    p_user uuid,
+    p_text text,
+    p_start timestamptz,
+    p_end timestamptz,
+    p_meta jsonb,
+    p_metrics jsonb,
+    p_feedback text default null
+)
+returns json
+language sql
+as $$
+    with a as (
+        insert into public.flow_attempts
+            (session_id, prompt_id, user_id, response_text, start_time, end_time, meta)
+        values
+            (p_session, p_prompt, p_user, p_text,
+             coalesce(p_start, now()), coalesce(p_end, now()), coalesce(p_meta, '{}'::jsonb))
+        returning *
+    ),
+    m as (
+        insert into public.flow_metrics
+            (attempt_id, user_id, elapsed_seconds, word_count, wpm, vocab_type_count, vocab_ttr,
+             repetition_rate, playfulness_score, clarity_score, creativity_score, composite_score)
+        select a.id, p_user, r.elapsed_seconds, r.word_count, r.wpm, r.vocab_type_count, r.vocab_ttr,
+               r.repetition_rate, r.playfulness_score, r.clarity_score, r.creativity_score, r.composite_score
+        from a, jsonb_populate_record(null::public.flow_metrics, coalesce(p_metrics, '{}'::jsonb)) r
+        returning *
+    ),
+    f as (
+        insert into public.flow_feedback (attempt_id, user_id, feedback)
+        select a.id, p_user, p_feedback
+        from a
+        where p_feedback is not null
+        returning *
+    )
+    select json_build_object(
+        'attempt', (select to_json(a) from a),
+        'metrics', (select to_json(m) from m),
+        'feedback', (select to_json(f) from f)
+    )
+$$;
@@ -0,0 +1,13 @@
+-- Cheap change token for a user's writings list: "<count>:<latest created_at>". It changes whenever
+-- a writing is added or removed, so the app can cache the list and refetch it only when the token
+-- moves. Served from the (user_id, created_at desc) index. Runs as the caller, so RLS still applies.
+
+create or replace function public.writings_version(uid uuid)
+returns text
+language sql
+stable
+as $$
+    select count(*)::text || ':' || coalesce(max(created_at)::text, '')
+    from public.writings
+    where user_id = uid
+$$;
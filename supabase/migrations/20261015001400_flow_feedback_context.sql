@@ -0,0 +1,33 @@
+-- Everything FlowState micro-feedback reads, in one call: the prompt that was answered, the user's
+-- last n attempts with their scores, and the 7-day baselines for the selected goal fields (same
+-- numbers as flow_metric_baselines). Replaces a prompt lookup, a recent-attempts query and the
+-- baselines call on the submit path. Runs before the new attempt is stored, so "recent" is history.
+-- Runs as the caller, so RLS still applies.
+
+create or replace function public.flow_feedback_context(
+    p_user uuid,
+    p_prompt uuid,
+    p_n integer default 3,
+    p_fields text[] default '{}',
+    p_days integer default 7
+)
+returns json
+language sql
+stable
+as $$
+    with recent as (
+        select a.created_at, m.word_count, m.wpm, m.composite_score,
+               m.playfulness_score, m.clarity_score, m.creativity_score
+        from public.flow_attempts a
+        left join public.flow_metrics m on m.attempt_id = a.id
+        where a.user_id = p_user
+        order by a.created_at desc
+        limit p_n
+    )
+    select json_build_object(
+        'prompt', (select json_build_object('id', p.id, 'text', p.text)
+                   from public.flow_prompts p where p.id = p_prompt),
+        'recent', (select coalesce(json_agg(to_json(r) order by r.created_at desc), '[]'::json) from recent r),
+        'baselines', public.flow_metric_baselines(p_user, p_fields, p_days)
+    )
+$$;
@@ -0,0 +1,17 @@
+-- One random active prompt from a teacher's own library, picked server-side: FlowState's "use my
+-- prompts" option used to download the teacher's whole library to choose one row in Python.
+-- Returns {"id", "text"} or null when the teacher has no active prompts.
+-- Runs as the caller, so RLS still applies.
+
+create or replace function public.random_teacher_prompt(tid uuid)
+returns jsonb
+language sql
+volatile
+as $$
+    select jsonb_build_object('id', fp.id, 'text', fp.text)
+    from public.flow_prompts fp
+    where fp.teacher_id = tid
+      and fp.active
+    order by random()
+    limit 1
+$$;
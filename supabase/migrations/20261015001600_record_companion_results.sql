@@ -0,0 +1,60 @@
+-- Record what the Writing Companion produced for a saved writing in one call and one transaction:
+-- the insight row, the reflection shown, and every 5th entry the style profile + snapshot. These
+-- were up to five round trips after the reflection finished (insight, feedback, exact count,
+-- profile upsert, snapshot insert).
+-- p_insight is a json object keyed by writing_insights column. The feedback row is skipped when
+-- p_feedback is null. The snapshot text matches what the app used to build client-side.
+-- Returns {insight, feedback, entries, snapshot}. Runs as the caller, so RLS still applies.
+
+create or replace function public.record_companion_results(
+    p_user uuid,
+    p_writing uuid,
+    p_insight jsonb,
+    p_feedback text default null,
+    p_mode text default 'spotlight'
+)
+returns json
+language sql
+as $$
+    with i as (
+        insert into public.writing_insights
+            (writing_id, intention, tone, energy, observations, micro_suggestions, metrics)
+        select p_writing, r.intention, r.tone, r.energy, r.observations,
+               coalesce(r.micro_suggestions, '[]'::jsonb), coalesce(r.metrics, '{}'::jsonb)
+        from jsonb_populate_record(null::public.writing_insights, coalesce(p_insight, '{}'::jsonb)) r
+        returning *
+    ),
+    f as (
+        insert into public.companion_feedback (writing_id, feedback, mode)
+        select p_writing, p_feedback, coalesce(p_mode, 'spotlight')
+        where p_feedback is not null
+        returning *
+    ),
+    n as (
+        select count(*) as entries from public.writings where user_id = p_user
+    ),
+    s as (
+        select format('By entry %s, tone leans ''%s'' with ''%s'' intent; energy ''%s''.',
+                      n.entries,
+                      coalesce(i.tone, 'None'), coalesce(i.intention, 'None'), coalesce(i.energy, 'None')) as snapshot
+        from n, i
+        where n.entries % 5 = 0
+    ),
+    p as (
+        insert into public.style_profiles (user_id, summary, traits)
+        select p_user, s.snapshot, '{}'::jsonb from s
+        on conflict (user_id) do update set summary = excluded.summary, traits = excluded.traits
+        returning 1
+    ),
+    ss as (
+        insert into public.style_snapshots (user_id, snapshot, signals)
+        select p_user, s.snapshot, '{}'::jsonb from s
+        returning 1
+    )
+    select json_build_object(
+        'insight', (select to_json(i) from i),
+        'feedback', (select to_json(f) from f),
+        'entries', (select entries from n),
+        'snapshot', (select snapshot from s)
+    )
+$$;
@@ -0,0 +1,49 @@
+-- Content hash on writings, so a pasted-again draft is recognised without comparing full texts.
+-- text_sha256 is a stored generated column: every insert path gets it for free and existing rows
+-- are filled in by this migration. Not unique: earlier duplicates stay, and the app decides what
+-- to do with a repeat.
+
+-- convert_to is only stable (it looks up the encoding), so generated columns cannot call it directly;
+-- the name is fixed here, which makes the result immutable.
+create or replace function public.utf8_sha256(t text)
+returns bytea
+language sql
+immutable
+parallel safe
+as $$
+    select sha256(convert_to(t, 'UTF8'))
+$$;
+
+alter table public.writings
+    add column if not exists text_sha256 bytea
+    generated always as (public.utf8_sha256(text)) stored;
+
+create index if not exists writings_user_text_sha256_idx
+    on public.writings (user_id, text_sha256);
+
+-- The user's latest writing with this exact text (p_hash = hex sha256 of its UTF-8 bytes) and the
+-- newest reflection stored for it. Returns {id, title, created_at, feedback} or null.
+-- Runs as the caller, so RLS still applies.
+create or replace function public.find_writing_by_text(p_user uuid, p_hash text)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'id', w.id,
+        'title', w.title,
+        'created_at', w.created_at,
+        'feedback', (
+            select cf.feedback
+            from public.companion_feedback cf
+            where cf.writing_id = w.id
+            order by cf.created_at desc
+            limit 1
+        )
+    )
+    from public.writings w
+    where w.user_id = p_user
+      and w.text_sha256 = decode(p_hash, 'hex')
+    order by w.created_at desc
+    limit 1
+$$;
@@ -0,0 +1,29 @@
+import json
+from types import SimpleNamespace
+
+from src import ai_feedback
+
+class _StubClient:
+    """Answers batched companion calls with string ids, the way models sometimes echo them."""
+
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        batch = json.loads(kwargs["messages"][-1]["content"][len(ai_feedback._BATCH_TASK):])
+        reflections = [{"id": str(b["id"]), "reflection": f"about {b['writing']}"} for b in batch]
+        content = json.dumps({"reflections": reflections})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def test_feedback_many_accepts_string_ids_and_splits_under_output_cap(monkeypatch):
+    stub = _StubClient()
+    monkeypatch.setattr(ai_feedback, "_client", lambda: stub)
+
+    items = [{"text": f"draft {i}", "profile_summary": ""} for i in range(50)]
+    out = ai_feedback.get_ai_feedback_many(items, max_tokens_each=380)
+
+    assert out == [f"about draft {i}" for i in range(50)]
+    assert len(stub.calls) == 2
+    assert all(c["max_tokens"] <= ai_feedback._MAX_OUTPUT_TOKENS for c in stub.calls)
@@ -1,4 +1,4 @@
-from src.analyzer import analyze_text
+from src.analyzer import analyze_text, analyze_flow_text, analyze_flow_text_batch
 
 def test_analyze_text():
     text = "Hello world! This is a test."
@@ -6,3 +6,7 @@ def test_analyze_text():
     assert "sentence_length_avg" in metrics
     assert "vocab_richness" in metrics
     assert isinstance(metrics["frequent_words"], list)
+
+def test_analyze_flow_text_batch_matches_single():
+    texts = ["Wow, it was like a dream. Maybe it was painted red!", "", "Short and clear."]
+    assert analyze_flow_text_batch(texts) == [analyze_flow_text(t) for t in texts]
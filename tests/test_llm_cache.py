@@ -0,0 +1,67 @@
+import asyncio
+
+from src.llm_cache import DiskCache, ExactCache, SemanticCache
+
+def _fake_embed(text):
+    # Bag-of-letters vector: near-identical drafts land close together
+    return [text.count(c) for c in "abcdefghijklmnopqrstuvwxyz"]
+
+def test_semantic_cache_hits_near_duplicates_within_partition():
+    cache = SemanticCache(embed=_fake_embed, threshold=0.95)
+    calls = []
+
+    @cache.wrap(partition=lambda a: a["goal"])
+    def complete(text, goal):
+        calls.append(text)
+        return f"reply to {text}"
+
+    assert complete("the quick brown fox", "clarity") == "reply to the quick brown fox"
+    assert complete("the quick brown fox!", "clarity") == "reply to the quick brown fox"
+    assert len(calls) == 1
+
+    # Same text, different partition -> miss
+    complete("the quick brown fox", "playfulness")
+    assert len(calls) == 2
+
+def test_semantic_cache_skips_cache_when_embedding_fails():
+    def broken_embed(text):
+        raise RuntimeError("no key")
+
+    cache = SemanticCache(embed=broken_embed)
+
+    @cache.wrap(partition=lambda a: None)
+    async def complete(text):
+        return text.upper()
+
+    assert asyncio.run(complete("hello")) == "HELLO"
+
+def test_exact_cache_serves_repeats_and_never_caches_errors():
+    cache = ExactCache(maxsize=2)
+    calls = []
+
+    @cache.wrap(key=lambda a: a["text"])
+    def complete(text):
+        calls.append(text)
+        if text == "boom":
+            raise RuntimeError("rate limited")
+        return text.upper()
+
+    assert complete("hi") == "HI"
+    assert complete("hi") == "HI"
+    assert calls == ["hi"]
+
+    for _ in range(2):
+        try:
+            complete("boom")
+        except RuntimeError:
+            pass
+    assert calls.count("boom") == 2
+
+def test_disk_cache_round_trips_and_expires(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    cache.set("k", {"overall": 3.5, "per_criterion": {"Thesis": 4}})
+    assert cache.get("k") == {"overall": 3.5, "per_criterion": {"Thesis": 4}}
+    assert cache.get("missing") is None
+
+    cache.ttl = -1
+    assert cache.get("k") is None
@@ -0,0 +1,13 @@
+import ast
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+def test_no_duplicate_top_level_definitions():
+    # A second def silently replaces the first at import time
+    for path in sorted(SRC.glob("*.py")):
+        seen = set()
+        for node in ast.parse(path.read_text(encoding="utf-8")).body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                assert node.name not in seen, f"{path.name}: {node.name} defined twice"
+                seen.add(node.name)
@@ -0,0 +1,33 @@
+from src import storage
+
+def _fresh(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "PROFILE_PATH", str(tmp_path / "user_profile.json"))
+    monkeypatch.setattr(storage, "PROFILE_DB_PATH", str(tmp_path / "profile.sqlite3"))
+    monkeypatch.setattr(storage, "_conn", None)
+
+def test_update_profile_keeps_running_averages(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    assert storage.load_profile() == {}
+
+    storage.update_profile({"sentence_length_avg": 10.0, "vocab_richness": 0.5, "frequent_words": ["sun", "sea"]})
+    p = storage.update_profile({"sentence_length_avg": 20.0, "vocab_richness": 0.7, "frequent_words": ["sea", "sky"]})
+
+    assert p["count"] == 2
+    assert p["avg_sentence_length"] == 15.0
+    assert abs(p["vocab_richness"] - 0.6) < 1e-9
+    assert p["frequent_words"] == {"sea": 2, "sky": 1, "sun": 1}
+    assert storage.load_profile() == p
+
+def test_frequent_words_are_capped(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    monkeypatch.setattr(storage, "TOP_WORDS", 3)
+    storage.update_profile({"sentence_length_avg": 1.0, "vocab_richness": 0.1, "frequent_words": ["a", "b", "c", "d"]})
+    p = storage.update_profile({"sentence_length_avg": 1.0, "vocab_richness": 0.1, "frequent_words": ["c"]})
+    assert list(p["frequent_words"].items()) == [("c", 2), ("a", 1), ("b", 1)]
+
+def test_repeated_metrics_are_not_counted_twice(tmp_path, monkeypatch):
+    _fresh(tmp_path, monkeypatch)
+    metrics = {"sentence_length_avg": 12.0, "vocab_richness": 0.4, "frequent_words": ["rain"]}
+    first = storage.update_profile(metrics)
+    assert storage.update_profile(dict(metrics)) == first
+    assert storage.update_profile({**metrics, "vocab_richness": 0.6})["count"] == 2
@@ -2,39 +2,37 @@
 import streamlit as st
 import sys, os
 from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import io
+import re
+import threading
+from contextlib import contextmanager
+import hashlib
+import functools
+import numpy as np
+import pandas as pd  # ships with Streamlit
 
 # ❗ No CSS injection — rely on config.toml theme
 
-# Optional file parsers for rubric uploads
-try:
-    import PyPDF2
-except Exception:
-    PyPDF2 = None
-try:
-    import docx  # python-docx
-except Exception:
-    docx = None
-
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from src.db import (
     # Auth
-    sign_up, sign_in, sign_out, get_current_user, set_session,
+    sign_up, sign_in, sign_out, restore_session,
     # Core writings
-    save_writing, list_writings, count_writings,
-    insert_writing_insight, insert_companion_feedback,
-    upsert_style_profile, insert_style_snapshot,
+    save_writing, list_writings, writings_version, get_writing_text, find_writing_by_text,
+    record_companion_results,
     # FlowState additions
-    create_flow_session, random_flow_prompt, insert_flow_attempt,
-    insert_flow_metrics, user_metric_baseline, insert_flow_feedback,
+    create_flow_session, random_flow_prompt, record_flow_submit, flow_feedback_context,
     create_flow_prompt, list_flow_prompts_for_teacher, set_flow_prompt_active,
     assign_prompts_to_assignment, remove_prompt_from_assignment, list_prompts_for_assignment,
-    random_assigned_prompt,
+    random_assigned_prompt, random_teacher_prompt,
     # GradeSim
     create_rubric, list_rubrics, get_rubric, archive_rubric,
-    add_rubric_criterion, list_rubric_criteria, update_rubric_criterion, delete_rubric_criterion,
-    add_grading_sample, list_grading_samples, delete_grading_sample,
+    add_rubric_criterion, add_rubric_criteria, list_rubric_criteria, update_rubric_criterion, delete_rubric_criterion,
+    add_grading_sample, list_grading_samples, get_grading_samples, delete_grading_sample,
+    GRADING_SAMPLE_LIST_FIELDS,
     create_grader_version, list_grader_versions, set_active_grader_version, get_active_grader_version,
     # Assignments
     create_assignment, list_assignments, get_assignment, update_assignment, delete_assignment,
@@ -43,13 +41,9 @@ from src.db import (
     # Activity
     log_activity, get_user_overview, get_user_context_pack
 )
-from src.supabase_client import supabase
 
-# Optional analysis imports (comment out if not ready)
-from src.analyzer import analyze_text, analyze_flow_text, compute_flow_composite
-from src.tone_classifier import classify_tone
-from src.ai_feedback import get_ai_feedback, get_flow_feedback
-from src.ai_grader import extract_rubric_schema, extract_scored_sample, grade_with_rubric
+# Analysis and LLM modules (spaCy model, OpenAI SDK) are imported where they are first used, so the
+# sign-in screen and a cold start don't pay for them.
 
 st.set_page_config(page_title="UnderWriter", page_icon="✍️", layout="centered")
 
@@ -59,27 +53,116 @@ if "user" not in st.session_state:
 if "sb_session" not in st.session_state:
     st.session_state.sb_session = None
 
-# Try to restore session on every run
+# Restore the session on every run; no round trip unless the client holds a different token
 try:
     if st.session_state.sb_session:
-        set_session(
+        sess = restore_session(
             st.session_state.sb_session["access_token"],
             st.session_state.sb_session["refresh_token"],
         )
-        u = get_current_user().user
-        if u and not st.session_state.user:
-            st.session_state.user = {"id": u.id, "email": u.email}
+        if sess:
+            # keep refreshed tokens, or the next rerun would present a spent refresh token
+            st.session_state.sb_session = {"access_token": sess.access_token, "refresh_token": sess.refresh_token}
+            if sess.user and not st.session_state.user:
+                st.session_state.user = {"id": sess.user.id, "email": sess.user.email}
 except Exception:
     pass
 
-def current_user_id():
-    if st.session_state.user and "id" in st.session_state.user:
-        return st.session_state.user["id"]
+# Process-wide cap on in-flight interactive LLM calls (every session shares it), so a burst of
+# submits queues here instead of piling onto the provider's rate limits.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+
+@st.cache_resource
+def _llm_slots() -> threading.BoundedSemaphore:
+    return threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+@contextmanager
+def _llm_slot(quiet: bool = False):
+    # quiet: no spinner of its own, for use inside st.cache_data functions (the caller shows one)
+    slots = _llm_slots()
+    if not slots.acquire(blocking=False):
+        if quiet:
+            slots.acquire()
+        else:
+            with st.spinner("Waiting for AI capacity…"):
+                slots.acquire()
     try:
-        u = get_current_user().user
-        return u.id if u else None
-    except Exception:
-        return None
+        yield
+    finally:
+        slots.release()
+
+def _script_pool(max_workers: int) -> ThreadPoolExecutor:
+    """
+    Thread pool whose workers carry this run's ScriptRunContext, so st.cache_data wrappers called
+    in them resolve the session and cache as on the script thread (and don't log warnings).
+    """
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx),
+    )
+
+WRITINGS_PAGE_SIZE = 20
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_writings_version(uid: str) -> str:
+    # The change token itself is a round trip: reuse it for a minute; saving here clears it at once
+    return writings_version(uid)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_list_writings(uid: str, version: str, page: int = 0):
+    # `version` is only part of the cache key: a new or deleted writing changes it and forces a refetch
+    return list_writings(uid, limit=WRITINGS_PAGE_SIZE, offset=page * WRITINGS_PAGE_SIZE)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_writing_text(uid: str, writing_id: str) -> str:
+    # The cache is shared by every session in the process: key it on the owner as well as the id
+    return get_writing_text(writing_id, user_id=uid)
+
+# Short-lived caches for the reads every rerun repeats. The write paths below clear the matching
+# wrapper, so a user always sees their own change on the next rerun.
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_list_rubrics(uid: str):
+    return list_rubrics(uid)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_teacher_prompts(uid: str):
+    return list_flow_prompts_for_teacher(uid, active_only=False)
+
+def _toggle_prompt_active(prompt_id: str, key: str):
+    # on_change callback: runs once per actual click, before the rerun that follows it
+    set_flow_prompt_active(prompt_id, st.session_state[key])
+    _cached_teacher_prompts.clear()
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_list_assignments(uid: str, rubric_id: str):
+    return list_assignments(uid, rubric_id=rubric_id)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_rubric_criteria(rubric_id: str):
+    return list_rubric_criteria(rubric_id)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_grading_samples(uid: str, rubric_id: str, assignment_id: str):
+    return list_grading_samples(uid, rubric_id=rubric_id, assignment_id=assignment_id,
+                                fields=GRADING_SAMPLE_LIST_FIELDS)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_anchor_samples(uid: str, rubric_id: str, assignment_id: str, anchor_ids: tuple):
+    # Full rows (with essay text) only for the anchors a self-test actually sends to the grader
+    if anchor_ids:
+        return get_grading_samples(anchor_ids)
+    return list_grading_samples(uid, rubric_id=rubric_id, assignment_id=assignment_id, limit=6)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_active_grader_version(uid: str, rubric_id: str):
+    return get_active_grader_version(uid, rubric_id)
+
+def current_user_id():
+    # Resolved once at sign-in / session restore; never a network call
+    user = st.session_state.user
+    return user["id"] if user and "id" in user else None
 
 # ---- Auth UI ----
 def auth_screen():
@@ -99,8 +182,7 @@ def auth_screen():
                         "access_token": session.access_token,
                         "refresh_token": session.refresh_token,
                     }
-                    set_session(session.access_token, session.refresh_token)
-                    user = get_current_user().user
+                    user = res.user  # sign_in already stored the session on the client
                     st.session_state.user = {"id": user.id, "email": user.email}
                     st.success("Signed in.")
                     st.rerun()
@@ -134,20 +216,21 @@ def flowstate_section():
     role = (prof or {}).get("role", "student")
     is_teacher = role in ("teacher", "admin")
 
-    defaults = {
-        "fs_session_id": None,
-        "fs_prompt": None,
-        "fs_prompt_id": None,
-        "fs_started_at": None,
-        "fs_mode": "timed",
-        "fs_duration": 90,
-        "fs_target_words": 120,
-        "fs_goals": [],
-        "fs_response": "",
-        "fs_use_my_prompts": False,
-    }
-    for k, v in defaults.items():
-        st.session_state.setdefault(k, v)
+    # Seed FlowState keys once per browser session; later reruns skip straight past this
+    if "_fs_inited" not in st.session_state:
+        st.session_state.update({
+            "fs_session_id": None,
+            "fs_prompt": None,
+            "fs_prompt_id": None,
+            "fs_started_at": None,
+            "fs_mode": "timed",
+            "fs_duration": 90,
+            "fs_target_words": 120,
+            "fs_goals": [],
+            "fs_response": "",
+            "fs_use_my_prompts": False,
+            "_fs_inited": True,
+        })
 
     if is_teacher:
         with st.expander("Teacher: Manage FlowState prompts"):
@@ -166,10 +249,11 @@ def flowstate_section():
                 if addp and new_prompt_text.strip():
                     tags = [t.strip() for t in (tag_str or "").split(",") if t.strip()]
                     create_flow_prompt(uid, new_prompt_text.strip(), tags=tags, level=(level or None) or None, active=active)
+                    _cached_teacher_prompts.clear()
                     st.success("Prompt created.")
                     st.rerun()
 
-            teacher_prompts = list_flow_prompts_for_teacher(uid, active_only=False)
+            teacher_prompts = _cached_teacher_prompts(uid)
             if not teacher_prompts:
                 st.caption("You haven’t created any prompts yet.")
             else:
@@ -177,12 +261,11 @@ def flowstate_section():
                 for p in teacher_prompts[:50]:
                     colx, coly = st.columns([6,2])
                     colx.write(f"• {p['text'][:100]}{'…' if len(p['text'])>100 else ''}")
-                    new_act = coly.checkbox(
-                        "Active", value=p.get("active", True), key=f"fsp_toggle_{p['id']}"
+                    key = f"fsp_toggle_{p['id']}"
+                    coly.checkbox(
+                        "Active", value=p.get("active", True), key=key,
+                        on_change=_toggle_prompt_active, args=(p["id"], key),
                     )
-                    if new_act != p.get("active", True):
-                        set_flow_prompt_active(p["id"], new_act)
-                        st.experimental_rerun()
 
             st.session_state.fs_use_my_prompts = st.checkbox(
                 "When I start a burst, use only my prompts (not global)",
@@ -190,14 +273,6 @@ def flowstate_section():
                 key="fsp_use_mine",
             )
 
-    def _random_teacher_prompt(teacher_id: str):
-        rows = list_flow_prompts_for_teacher(teacher_id, active_only=True)
-        if not rows:
-            return None
-        import random
-        r = random.choice(rows)
-        return {"id": r["id"], "text": r["text"]}
-
     with st.form("fs_setup", clear_on_submit=False):
         st.subheader("Setup")
         c1, c2, c3 = st.columns(3)
@@ -255,9 +330,9 @@ def flowstate_section():
 
         prompt_row = None
         if is_teacher and st.session_state.fs_use_my_prompts:
-            prompt_row = _random_teacher_prompt(uid)
+            prompt_row = random_teacher_prompt(uid)
         if not prompt_row:
-            prompt_row = random_flow_prompt()
+            prompt_row = random_flow_prompt(user_id=uid)
         st.session_state.fs_prompt = (prompt_row or {}).get(
             "text", "Write the first thing that comes to mind about a sound you can hear right now."
         )
@@ -276,19 +351,58 @@ def flowstate_section():
         else:
             st.caption(f"Started at {st.session_state.fs_started_at.isoformat()} (UTC)")
 
-        st.session_state.fs_response = st.text_area(
-            "Your burst (submit in one go; keep it spontaneous)",
-            value=st.session_state.fs_response,
-            height=200,
-            placeholder="Type fast. Don’t overthink.",
-            key="fs_response_text",
-        )
+        # A form: typing does not rerun the page, only Submit does (and the box clears for the next prompt)
+        with st.form("fs_burst", clear_on_submit=True):
+            st.session_state.fs_response = st.text_area(
+                "Your burst (submit in one go; keep it spontaneous)",
+                value=st.session_state.fs_response,
+                height=200,
+                placeholder="Type fast. Don’t overthink.",
+                key="fs_response_text",
+            )
+            submitted = st.form_submit_button(
+                "Submit", key="fs_submit_btn", disabled=st.session_state.fs_started_at is None
+            )
 
-        if st.session_state.fs_started_at and st.button("Submit", key="fs_submit_btn"):
+        if submitted and st.session_state.fs_started_at:
             end_time = datetime.now(timezone.utc)
             elapsed = (end_time - st.session_state.fs_started_at).total_seconds()
 
-            attempt = insert_flow_attempt(
+            from src.analyzer import analyze_flow_text, compute_flow_composite
+            from src.ai_feedback import get_flow_feedback
+
+            m = analyze_flow_text(st.session_state.fs_response)
+            composite = compute_flow_composite(
+                elapsed_seconds=elapsed, metrics=m, goal_focus=st.session_state.fs_goals
+            )
+            # analyze_flow_text's keys are flow_metrics columns, so the row is the analysis plus timing
+            wpm = round(m["word_count"] * 60.0 / max(elapsed, 1e-6), 2)
+            metrics = {**m, "elapsed_seconds": round(elapsed, 2), "wpm": wpm, "composite_score": composite}
+
+            goals = st.session_state.fs_goals
+            keys = [f"{g}_score" for g in goals]
+            # prompt, recent attempts and goal baselines in one round trip
+            ctx = flow_feedback_context(uid, st.session_state.fs_prompt_id, n=3, metric_fields=keys, days=7)
+            baselines = ctx.get("baselines") or {}
+            # one vector subtract for every goal's delta against its 7-day baseline
+            deltas = np.round(
+                np.array([m[k] for k in keys], dtype=float)
+                - np.array([baselines.get(k) or 0.0 for k in keys], dtype=float),
+                4,
+            )
+            trend_bits = [
+                f"{focus.capitalize()} {('+' if delta >= 0 else '')}{delta:.2f}"
+                for focus, delta in zip(goals, deltas.tolist())
+            ]
+            last_trends = "; ".join(trend_bits) if trend_bits else "no active goal trend"
+
+            with _llm_slot():
+                fb = get_flow_feedback(
+                    st.session_state.fs_response, goals, last_trends=last_trends,
+                    context_pack={"prompt": ctx.get("prompt"), "recent_attempts": ctx.get("recent")},
+                )
+            # attempt + metrics + feedback in one round trip / transaction
+            saved = record_flow_submit(
                 session_id=st.session_state.fs_session_id,
                 prompt_id=st.session_state.fs_prompt_id,
                 user_id=uid,
@@ -300,31 +414,14 @@ def flowstate_section():
                     "duration": st.session_state.fs_duration,
                     "target_words": st.session_state.fs_target_words,
                 },
+                metrics=metrics,
+                feedback_text=fb,
             )
-
-            m = analyze_flow_text(st.session_state.fs_response)
-            composite = compute_flow_composite(
-                elapsed_seconds=elapsed, metrics=m, goal_focus=st.session_state.fs_goals
-            )
-            metrics_row = insert_flow_metrics(
-                attempt_id=attempt["id"],
-                user_id=uid,
-                metrics={
-                    "elapsed_seconds": round(elapsed, 2),
-                    "word_count": m["word_count"],
-                    "wpm": round(60.0 * m["word_count"] / max(elapsed, 1e-6), 2),
-                    "vocab_type_count": m["vocab_type_count"],
-                    "vocab_ttr": m["vocab_ttr"],
-                    "repetition_rate": m["repetition_rate"],
-                    "playfulness_score": m["playfulness_score"],
-                    "clarity_score": m["clarity_score"],
-                    "creativity_score": m["creativity_score"],
-                    "composite_score": composite,
-                },
-            )
+            attempt = saved.get("attempt") or {}
+            metrics_row = saved.get("metrics") or metrics
             try:
                 log_activity(uid, "flow_burst_submitted", {
-                    "attempt_id": attempt["id"],
+                    "attempt_id": attempt.get("id"),
                     "elapsed_seconds": metrics_row["elapsed_seconds"],
                     "word_count": metrics_row["word_count"],
                     "vocab_ttr": metrics_row["vocab_ttr"],
@@ -335,20 +432,6 @@ def flowstate_section():
             except Exception:
                 pass
 
-            trend_bits = []
-            for focus in st.session_state.fs_goals:
-                key = f"{focus}_score"
-                baseline = user_metric_baseline(uid, key, days=7) or 0.0
-                val = float(m[key])
-                delta = round(val - baseline, 4)
-                trend_bits.append(f"{focus.capitalize()} {('+' if delta >= 0 else '')}{delta:.2f}")
-            last_trends = "; ".join(trend_bits) if trend_bits else "no active goal trend"
-
-            fb = get_flow_feedback(
-                st.session_state.fs_response, st.session_state.fs_goals, last_trends=last_trends
-            )
-            insert_flow_feedback(attempt_id=attempt["id"], user_id=uid, feedback_text=fb)
-
             st.success("Submitted!")
             b1, b2, b3, b4, b5 = st.columns(5)
             b1.metric("WPM", f'{metrics_row["wpm"]}')
@@ -363,9 +446,9 @@ def flowstate_section():
 
             next_prompt = None
             if is_teacher and st.session_state.fs_use_my_prompts:
-                next_prompt = _random_teacher_prompt(uid)
+                next_prompt = random_teacher_prompt(uid)
             if not next_prompt:
-                next_prompt = random_flow_prompt()
+                next_prompt = random_flow_prompt(user_id=uid)
 
             st.session_state.fs_prompt = (next_prompt or {}).get(
                 "text", "Write the first thing that comes to mind about a texture you can feel."
@@ -378,38 +461,97 @@ def flowstate_section():
 # ----------------------------
 # GradeSim — Teacher Console
 # ----------------------------
+_PDF_MAX_CHARS = 40_000  # ~10k tokens; rubrics and student essays are far shorter
+_PDF_MAX_PAGES = int(os.getenv("MAX_PDF_PAGES", "60"))  # also bounds scanned PDFs that yield no text
+
+# Optional file parsers, imported on the first upload. pypdf is PyPDF2's maintained successor (same
+# PdfReader API, much faster stream scanning); PyPDF2 still works if that is what's installed.
+@functools.lru_cache(maxsize=None)
+def _pdf_lib():
+    try:
+        import pypdf
+        return pypdf
+    except Exception:
+        try:
+            import PyPDF2
+            return PyPDF2
+        except Exception:
+            return None
+
+@functools.lru_cache(maxsize=None)
+def _docx_lib():
+    try:
+        import docx  # python-docx
+        return docx
+    except Exception:
+        return None
+
+def _hash_bytes(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
 def _read_uploaded_text(uploaded_file) -> str:
     if uploaded_file is None:
         return ""
-    name = uploaded_file.name.lower()
-    data = uploaded_file.read()
-    buf = io.BytesIO(data)
-
-    if name.endswith(".pdf"):
-        if not PyPDF2:
-            return "(Install PyPDF2 to parse PDFs)"
+    # UploadedFile is an in-memory BytesIO: hash a zero-copy view of it and let the parsers read the
+    # file object itself, rather than copying the bytes out and wrapping them in a second BytesIO
+    with uploaded_file.getbuffer() as view:
+        digest = _hash_bytes(view)
+    suffix = uploaded_file.name.lower().rsplit(".", 1)[-1]
+    return _parse_upload(suffix, digest, uploaded_file)
+
+# Streamlit reruns the whole script on every widget change while the upload stays in place, so the
+# extracted text is cached per file content. `_file` is skipped by Streamlit's hashing; `digest` is the key.
+@st.cache_data(show_spinner=False, max_entries=8)
+def _parse_upload(suffix: str, digest: str, _file) -> str:
+    _file.seek(0)
+
+    if suffix == "pdf":
+        pdf = _pdf_lib()
+        if not pdf:
+            return "(Install pypdf to parse PDFs)"
         try:
-            reader = PyPDF2.PdfReader(buf)
-            pages = [p.extract_text() or "" for p in reader.pages]
-            return "\n\n".join(pages).strip()
+            reader = pdf.PdfReader(_file)
+            # Pages are extracted lazily and we stop once we have enough text: a rubric is
+            # usually the first page or two, and layout extraction is the slow part.
+            out, total = io.StringIO(), 0
+            for i, p in enumerate(reader.pages):
+                if i >= _PDF_MAX_PAGES:
+                    break
+                t = p.extract_text() or ""
+                out.write(t)
+                out.write("\n\n")
+                total += len(t)
+                if total >= _PDF_MAX_CHARS:
+                    break
+            return out.getvalue().strip()
         except Exception:
             return "(Could not parse PDF. Try a .docx or .txt.)"
 
-    if name.endswith(".docx"):
+    if suffix == "docx":
+        docx = _docx_lib()
         if not docx:
             return "(Install python-docx to parse DOCX)"
         try:
-            d = docx.Document(buf)
+            d = docx.Document(_file)
             return "\n".join(p.text for p in d.paragraphs).strip()
         except Exception:
             return "(Could not parse DOCX. Try a PDF or .txt.)"
 
     try:
-        return data.decode("utf-8", errors="ignore")
+        return _file.getvalue().decode("utf-8", errors="ignore")
     except Exception:
         return "(Unsupported file encoding)"
 
+# The uploader keeps the file across reruns, so the same text would be re-extracted on every widget change
+@st.cache_data(ttl=86400, show_spinner=False, max_entries=64)
+def _cached_extract_schema(text_hash: str, _raw_text: str) -> dict:
+    from src.ai_grader import extract_rubric_schema
+    with _llm_slot(quiet=True):  # only a miss reaches the model, so only a miss waits for a slot
+        return extract_rubric_schema(_raw_text)
+
 def gradesim_teacher_section():
+    from src.ai_grader import is_fallback_rubric, extract_scored_sample
+
     st.header("GradeSim — Teacher Console")
 
     uid = current_user_id()
@@ -432,13 +574,19 @@ def gradesim_teacher_section():
             st.error(raw_text or "Could not read file.")
         else:
             with st.spinner("Extracting rubric…"):
-                schema = extract_rubric_schema(raw_text)
+                schema = _cached_extract_schema(_hash_bytes(raw_text.encode("utf-8")), raw_text)
+            if is_fallback_rubric(schema):
+                _cached_extract_schema.clear()  # never keep the placeholder; retry on the next rerun
             if not schema.get("scale"):
                 schema["scale"] = scale_choice
 
             st.success(f"Extracted: {schema.get('title','(untitled)')}")
+            # Typed columns: Streamlit gets a ready DataFrame instead of inferring one from row dicts each rerun
             st.dataframe(
-                [{"Criterion": c["name"], "Weight": c["weight"]} for c in schema["criteria"]],
+                pd.DataFrame({
+                    "Criterion": pd.array([c["name"] for c in schema["criteria"]], dtype="string"),
+                    "Weight": np.array([c["weight"] for c in schema["criteria"]], dtype=float),
+                }),
                 use_container_width=True,
             )
             if st.button("Save rubric", key="save_extracted_rubric_btn"):
@@ -449,19 +597,22 @@ def gradesim_teacher_section():
                     grade_level=None,
                     scale=schema.get("scale") or "0-4",
                 )
-                for c in schema["criteria"]:
-                    add_rubric_criterion(
-                        rubric_id=rrow["id"],
-                        name=c["name"],
-                        descriptor_levels=c.get("descriptor_levels") or {"4":"","3":"","2":"","1":"","0":""},
-                        weight=float(c["weight"]),
-                    )
+                add_rubric_criteria(rrow["id"], [
+                    {
+                        "name": c["name"],
+                        "descriptor_levels": c.get("descriptor_levels") or {"4":"","3":"","2":"","1":"","0":""},
+                        "weight": float(c["weight"]),
+                    }
+                    for c in schema["criteria"]
+                ])
+                _cached_list_rubrics.clear()
+                _cached_rubric_criteria.clear()
                 st.success(f"Saved rubric '{rrow['title']}' with {len(schema['criteria'])} criteria.")
 
     st.divider()
 
     st.subheader("Assignments")
-    rubrics = list_rubrics(uid)
+    rubrics = _cached_list_rubrics(uid)
     if not rubrics:
         st.caption("No rubrics yet. Upload one above.")
         return
@@ -482,13 +633,29 @@ def gradesim_teacher_section():
                 teacher_id=uid, rubric_id=rubric["id"], title=a_title.strip() or "Untitled Assignment",
                 period=a_period or None, due_date=(a_due.isoformat() if a_due else None), leniency=leniency
             )
+            _cached_list_assignments.clear()
             st.success(f"Assignment created: {row['title']}")
 
-    assignments = list_assignments(uid, rubric_id=rubric["id"])
+    # These reads depend only on the rubric, so they go out together rather than one after another
+    with _script_pool(max_workers=3) as pool:
+        f_assignments = pool.submit(_cached_list_assignments, uid, rubric["id"])
+        f_crits = pool.submit(_cached_rubric_criteria, rubric["id"])
+        f_active = pool.submit(_cached_active_grader_version, uid, rubric["id"])
+    assignments, crits, active = f_assignments.result(), f_crits.result(), f_active.result()
     if not assignments:
         st.caption("No assignments yet for this rubric.")
         return
 
+    # The schema the extractor and the grader both read, built once for the sample upload and the self-test
+    rubric_schema = {
+        "title": rubric["title"],
+        "scale": rubric["scale"],
+        "criteria": [
+            {"name": c["name"], "weight": float(c["weight"]), "descriptor_levels": c["descriptor_levels"]}
+            for c in crits
+        ],
+    }
+
     assignment_map = {f"{a['title']} ({a.get('period') or 'all'}) [{a['id'][:6]}]": a for a in assignments}
     sel_asn = st.selectbox("Select assignment", list(assignment_map.keys()), key="gs_assignment_select")
     assignment = assignment_map[sel_asn]
@@ -507,14 +674,8 @@ def gradesim_teacher_section():
         else:
             essay_text = _read_uploaded_text(essay_file) if essay_file else ""
             rubric_text = _read_uploaded_text(graded_rubric_file)
-            crits = list_rubric_criteria(rubric["id"])
-            schema = {
-                "title": rubric["title"],
-                "scale": rubric["scale"],
-                "criteria": [{"name": c["name"], "weight": float(c["weight"]), "descriptor_levels": c["descriptor_levels"]} for c in crits],
-            }
-            with st.spinner("Reading the filled rubric…"):
-                scored = extract_scored_sample(rubric_text, schema)
+            with _llm_slot(), st.spinner("Reading the filled rubric…"):
+                scored = extract_scored_sample(rubric_text, rubric_schema)
             st.json(scored, expanded=False)
 
             row = add_grading_sample(
@@ -527,10 +688,12 @@ def gradesim_teacher_section():
                 per_criterion=scored.get("per_criterion"),
                 rationales=scored.get("rationales"),
             )
+            _cached_grading_samples.clear()
+            _cached_anchor_samples.clear()
             st.success(f"Saved graded sample {row['id'][:8]}.")
 
     st.markdown("**Recent samples for this assignment**")
-    samples = list_grading_samples(uid, rubric_id=rubric["id"], assignment_id=assignment["id"])
+    samples = _cached_grading_samples(uid, rubric["id"], assignment["id"])
     if not samples:
         st.caption("No samples yet.")
     else:
@@ -539,36 +702,27 @@ def gradesim_teacher_section():
                 st.json({"overall": s.get("overall"), "per_criterion": s.get("per_criterion")}, expanded=False)
 
     st.divider()
+    _selftest_panel(uid, rubric, assignment, rubric_schema, active)
+
+@st.fragment
+def _selftest_panel(uid, rubric, assignment, rubric_schema, active):
+    """
+    GradeSim self-test. A fragment: the score inputs and the run button rerun only this panel,
+    not the rubric/assignment reads and upload parsing above it.
+    """
+    from src.ai_grader import grade_with_rubric
+
     st.subheader("Self-test the grader")
 
     test_col1, test_col2 = st.columns([2,1])
     test_essay = test_col1.file_uploader("Upload a student essay to test (PDF/DOCX/TXT)", type=["pdf","docx","txt"], key="selftest_essay")
     use_active = test_col2.checkbox("Use ACTIVE grader version (if any)", value=True, key="selftest_use_active")
 
-    crits = list_rubric_criteria(rubric["id"])
-    rubric_schema = {
-        "title": rubric["title"],
-        "scale": rubric["scale"],
-        "criteria": [
-            {"name": c["name"], "weight": float(c["weight"]), "descriptor_levels": c["descriptor_levels"]}
-            for c in crits
-        ],
-    }
-
-    anchors = []
+    anchor_ids = ()
     leniency_hint = assignment.get("leniency", 0.5)
-    if use_active:
-        active = get_active_grader_version(uid, rubric["id"])
-        if active:
-            leniency_hint = active.get("config", {}).get("leniency", leniency_hint)
-            anchor_ids = active.get("config", {}).get("anchors", [])
-            if anchor_ids:
-                all_for_asn = list_grading_samples(uid, rubric_id=rubric["id"], assignment_id=assignment["id"])
-                by_id = {s["id"]: s for s in all_for_asn}
-                anchors = [by_id[aid] for aid in anchor_ids if aid in by_id]
-
-    if not anchors:
-        anchors = list_grading_samples(uid, rubric_id=rubric["id"], assignment_id=assignment["id"])[:6]
+    if use_active and active:
+        leniency_hint = active.get("config", {}).get("leniency", leniency_hint)
+        anchor_ids = tuple(active.get("config", {}).get("anchors", []))
 
     with st.expander("Enter your true scores (optional) to compare"):
         teacher_overall = st.number_input(f"Your overall ({rubric['scale']})", min_value=0.0, max_value=100.0, value=0.0, step=0.5, key="selftest_teacher_overall")
@@ -586,8 +740,21 @@ def gradesim_teacher_section():
         else:
             essay_text = _read_uploaded_text(test_essay)
             with st.spinner("Grading with your rubric and anchors…"):
+                anchors = _cached_anchor_samples(uid, rubric["id"], assignment["id"], anchor_ids)
+                if not anchors and anchor_ids:  # active version's anchors were deleted: use the latest samples
+                    anchors = _cached_anchor_samples(uid, rubric["id"], assignment["id"], ())
                 anchor_min = [{"text": a.get("text") or "", "overall": a.get("overall"), "per_criterion": a.get("per_criterion")} for a in anchors]
-                pred = grade_with_rubric(essay_text, rubric_schema, anchors=anchor_min, leniency=leniency_hint)
+                live = st.empty()
+                streamed: list = []
+
+                def _show_progress(piece: str):
+                    streamed.append(piece)
+                    live.code("".join(streamed), language="json")
+
+                with _llm_slot():
+                    pred = grade_with_rubric(essay_text, rubric_schema, anchors=anchor_min,
+                                             leniency=leniency_hint, on_delta=_show_progress)
+                live.empty()
                 try:
                     log_activity(uid, "gradesim_selftest_run", {
                         "rubric_id": rubric["id"],
@@ -603,30 +770,88 @@ def gradesim_teacher_section():
             st.json(pred, expanded=False)
 
             if any(v != 0.0 for v in teacher_scores.values()) or teacher_overall != 0.0:
-                rows = []
-                abs_diffs = []
-                for c in rubric_schema["criteria"]:
-                    name = c["name"]
-                    ai = pred["per_criterion"].get(name)
-                    tr = teacher_scores.get(name)
-                    delta = (ai - tr) if (ai is not None and tr is not None) else None
-                    if delta is not None:
-                        abs_diffs.append(abs(delta))
-                    rows.append({"Criterion": name, "AI": ai, "Teacher": tr, "Δ (AI–Teacher)": delta})
-
-                mae = (sum(abs_diffs)/len(abs_diffs)) if abs_diffs else None
+                # Missing scores are NaN, so one subtract gives every delta and nan-aware ops skip the gaps
+                names = [c["name"] for c in rubric_schema["criteria"]]
+                ai_arr = np.array([pred["per_criterion"].get(n) for n in names], dtype=float)
+                tr_arr = np.array([teacher_scores.get(n) for n in names], dtype=float)
+                deltas = ai_arr - tr_arr
+                known = ~np.isnan(deltas)
+                mae = float(np.abs(deltas[known]).mean()) if known.any() else None
+
+                # The arrays above are the table's columns; NaN renders as an empty cell
+                comparison = pd.DataFrame({"Criterion": names, "AI": ai_arr, "Teacher": tr_arr, "Δ (AI–Teacher)": deltas})
                 o_ai = pred.get("overall")
                 o_tr = teacher_overall if teacher_overall != 0.0 else None
                 o_delta = (o_ai - o_tr) if (o_ai is not None and o_tr is not None) else None
 
                 st.markdown("**Comparison**")
-                st.dataframe(rows, use_container_width=True)
+                st.dataframe(comparison, use_container_width=True)
                 st.write(f"**Criterion MAE:** {mae:.2f}" if mae is not None else "**Criterion MAE:** n/a")
                 st.write(f"**Overall Δ (AI–Teacher):** {o_delta:.2f}" if o_delta is not None else "**Overall Δ:** n/a")
 
 # ----------------------------
 # App UI (authed)
 # ----------------------------
+# Intention cues (plain case-insensitive substrings), one named group per category, so a single
+# C-level pass finds every category present; earlier groups win, as the old if-chain did.
+_INTENT_RE = re.compile(
+    r"(?P<exploratory>i think|maybe|perhaps|wonder)"
+    r"|(?P<persuasive>should|must|need to|important)"
+    r"|(?P<expressive>i feel|i'm|sad|happy|excited)",
+    re.I,
+)
+_INTENT_ORDER = ("exploratory", "persuasive", "expressive")
+
+def infer_intention(txt: str) -> str:
+    if "?" in txt: return "inquisitive"
+    found = set()
+    for m in _INTENT_RE.finditer(txt):
+        if m.lastgroup == "exploratory":
+            return "exploratory"
+        found.add(m.lastgroup)
+    return next((k for k in _INTENT_ORDER if k in found), "descriptive")
+
+_ENERGY_LABELS = ("brisk", "steady", "calm/expansive")  # avg sentence length < 15, 15-21, >= 22
+
+def infer_energy(metrics) -> str:
+    avg_len = metrics.get("sentence_length_avg") or 0
+    return _ENERGY_LABELS[(avg_len >= 15) + (avg_len >= 22)]
+
+# analyze_text is a pure function of the text; a re-submitted draft skips the spaCy pass entirely
+@st.cache_data(ttl=1800, max_entries=256, show_spinner=False)
+def _cached_analysis(text: str) -> dict:
+    from src.analyzer import analyze_text
+    return analyze_text(text)
+
+@st.fragment
+def _past_writings(uid):
+    """
+    Past Writings list. A fragment: paging and "Show text" toggles rerun only this list, not the
+    companion form, FlowState and GradeSim tabs around it.
+    """
+    st.subheader("Your Past Writings")
+    if not uid:
+        st.warning("Please sign in to view your writings.")
+    else:
+        try:
+            version = _cached_writings_version(uid)
+            total = int(version.split(":", 1)[0] or 0)  # token is "<count>:<latest created_at>"
+            if not total:
+                st.write("No entries yet.")
+            else:
+                pages = -(-total // WRITINGS_PAGE_SIZE)
+                page = 1
+                if pages > 1:
+                    page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key="wc_writings_page")
+                    st.caption(f"{total} writings · page {page} of {pages}")
+                for w in _cached_list_writings(uid, version, int(page) - 1):
+                    with st.expander(f"{w.get('title') or '(untitled)'} — {w['created_at']}"):
+                        # Expander bodies run even when collapsed, so the text loads on demand
+                        if st.toggle("Show text", key=f"wc_show_text_{w['id']}"):
+                            st.code(_cached_writing_text(uid, w["id"]))
+        except Exception as e:
+            st.error(f"Could not load writings: {e}")
+
 def app_screen():
     st.title("✍️ UnderWriter")
     st.caption(f"Logged in as {st.session_state.user['email']}")
@@ -642,24 +867,16 @@ def app_screen():
 
     with t_objs[0]:
         st.subheader("New Writing")
-        title = st.text_input("Title (optional)", key="wc_title_input")
-        text = st.text_area("Write or paste text", height=180, key="wc_text_input")
-
-        def infer_intention(txt: str) -> str:
-            t = txt.lower()
-            if "?" in txt: return "inquisitive"
-            if any(w in t for w in ["i think", "maybe", "perhaps", "wonder"]): return "exploratory"
-            if any(w in t for w in ["should", "must", "need to", "important"]): return "persuasive"
-            if any(w in t for w in ["i feel", "i'm", "sad", "happy", "excited"]): return "expressive"
-            return "descriptive"
-
-        def infer_energy(metrics) -> str:
-            avg_len = metrics.get("sentence_length_avg", 0)
-            if avg_len >= 22: return "calm/expansive"
-            if avg_len >= 15: return "steady"
-            return "brisk"
-
-        if st.button("Analyze & Save", key="wc_analyze_btn"):
+        # A form: drafting does not rerun the page (and its reads) until Analyze & Save
+        with st.form("wc_form"):
+            title = st.text_input("Title (optional)", key="wc_title_input")
+            text = st.text_area("Write or paste text", height=180, key="wc_text_input")
+            analyze = st.form_submit_button("Analyze & Save", key="wc_analyze_btn")
+
+        if analyze:
+            from src.tone_classifier import classify_tone
+            from src.ai_feedback import stream_ai_feedback
+
             uid2 = current_user_id()
             if not uid2:
                 st.error("You must be signed in to save.")
@@ -668,74 +885,110 @@ def app_screen():
                 st.warning("Please enter some text.")
                 st.stop()
 
-            writing = save_writing(uid2, text, title=title or None, metadata={})
-            writing_id = writing["id"]
-            try:
-                log_activity(uid2, "writing_submitted", {"writing_id": writing_id, "title": title or None})
-            except Exception:
-                pass
-
-            try:
-                metrics = analyze_text(text)
-                tone = classify_tone(text)
-                intention = infer_intention(text)
-                energy = infer_energy(metrics)
-            except Exception:
-                metrics, tone, intention, energy = {}, None, None, None
-
-            feedback = None
-            try:
-                profile_summary = "Learning your style; reflections deepen as you write more."
-                ctx_pack = get_user_context_pack(uid2)
-                feedback = get_ai_feedback(text, profile_summary, ctx_pack)
-                st.markdown("**Reflection:**")
-                st.write(feedback)
-            except Exception as e:
-                st.info(f"(AI feedback unavailable) {e}")
+            # A double click (or a rerun mid-save) resubmits the same entry: finish the earlier writing
+            # instead of inserting a second one, and stop once it has been fully recorded.
+            submit_token = hashlib.blake2b(f"{title}\x00{text}".encode("utf-8"), digest_size=8).hexdigest()
+            recent_submits = st.session_state.setdefault("wc_recent_submits", {})
+            prior = recent_submits.get(submit_token)
+            if prior and prior["done"]:
+                st.info("This entry is already saved. Edit it to save a new one.")
+                st.stop()
+            if not prior:
+                # Same text saved and reflected on before (any session): show that instead of a new row + LLM call
+                try:
+                    dup = find_writing_by_text(uid2, text)
+                except Exception:
+                    dup = None
+                if dup and dup.get("feedback"):
+                    st.info(f"You saved this text on {dup['created_at'][:10]}. Here is the reflection from then.")
+                    st.markdown("**Reflection:**")
+                    st.markdown(dup["feedback"])
+                    recent_submits[submit_token] = {"writing_id": dup["id"], "done": True}
+                    st.stop()
+
+            def _save():
+                # Runs on the pool; marks the token as soon as the row exists, even if this run is interrupted
+                if prior:
+                    return {"id": prior["writing_id"]}
+                row = save_writing(uid2, text, title=title or None, metadata={})
+                recent_submits[submit_token] = {"writing_id": row["id"], "done": False}
+                while len(recent_submits) > 8:
+                    recent_submits.pop(next(iter(recent_submits)))
+                return row
+
+            # Saving, the tone call and the text analysis are independent, so they run on the pool; the
+            # context pack is read once the save lands (so it includes this writing) and the reflection
+            # streams on this thread as soon as it is in. Everything derived is recorded in one round trip.
+            with _script_pool(max_workers=4) as pool:
+                fut_writing = pool.submit(_save)
+                fut_tone = pool.submit(classify_tone, text)
+
+                def _context_pack():
+                    fut_writing.result()
+                    return get_user_context_pack(uid2)
+
+                fut_ctx = pool.submit(_context_pack)
+
+                def _analysis():
+                    try:
+                        metrics = _cached_analysis(text)
+                        return metrics, infer_intention(text), infer_energy(metrics)
+                    except Exception:
+                        return {}, None, None
+
+                fut_analysis = pool.submit(_analysis)
+
+                feedback = None
+                try:
+                    profile_summary = "Learning your style; reflections deepen as you write more."
+                    ctx_pack = fut_ctx.result()
+                    st.markdown("**Reflection:**")
+                    with _llm_slot():
+                        feedback = st.write_stream(stream_ai_feedback(text, profile_summary, ctx_pack))
+                except Exception as e:
+                    st.info(f"(AI feedback unavailable) {e}")
+
+                writing = fut_writing.result()
+                writing_id = writing["id"]
+                _cached_writings_version.clear()
+                if not prior:
+                    try:
+                        log_activity(uid2, "writing_submitted", {"writing_id": writing_id, "title": title or None})
+                    except Exception:
+                        pass
+
+                metrics, intention, energy = fut_analysis.result()
+                try:
+                    tone = fut_tone.result()
+                except Exception:
+                    tone = None
 
             try:
-                insert_writing_insight(
-                    writing_id=writing_id,
-                    intention=intention,
-                    tone=tone,
-                    energy=energy,
-                    observations=None,
-                    micro_suggestions=[],
-                    metrics={
-                        "avg_sentence_len": metrics.get("sentence_length_avg"),
-                        "vocab_richness": metrics.get("vocab_richness"),
+                # Insight, reflection and (every 5th entry) the style profile + snapshot, in one transaction
+                record_companion_results(
+                    uid2,
+                    writing_id,
+                    insight={
+                        "intention": intention,
+                        "tone": tone,
+                        "energy": energy,
+                        "observations": None,
+                        "micro_suggestions": [],
+                        "metrics": {
+                            "avg_sentence_len": metrics.get("sentence_length_avg"),
+                            "vocab_richness": metrics.get("vocab_richness"),
+                        },
                     },
+                    feedback=feedback or None,
+                    mode="spotlight",
                 )
-                if feedback:
-                    insert_companion_feedback(writing_id, feedback, mode="spotlight")
+                recent_submits[submit_token] = {"writing_id": writing_id, "done": True}
                 st.success("Saved.")
             except Exception as e:
                 st.error(f"Save insights/feedback failed: {e}")
 
-            try:
-                total = count_writings(uid2)
-                if total % 5 == 0:
-                    snap = f"By entry {total}, tone leans '{tone}' with '{intention}' intent; energy '{energy}'."
-                    upsert_style_profile(uid2, summary=snap, traits={})
-                    insert_style_snapshot(uid2, snapshot=snap, signals={})
-            except Exception:
-                pass
-
         st.divider()
-        st.subheader("Your Past Writings")
-        if not uid:
-            st.warning("Please sign in to view your writings.")
-        else:
-            try:
-                writings = list_writings(uid)
-                if not writings:
-                    st.write("No entries yet.")
-                else:
-                    for w in writings:
-                        with st.expander(f"{w.get('title') or '(untitled)'} — {w['created_at']}"):
-                            st.code(w["text"])
-            except Exception as e:
-                st.error(f"Could not load writings: {e}")
+        _past_writings(uid)
 
     with t_objs[1]:
         flowstate_section()
@@ -789,14 +1042,6 @@ def app_screen():
             st.rerun()
 
 # ---- Entry point ----
-try:
-    if st.session_state.user is None:
-        u = get_current_user().user
-        if u:
-            st.session_state.user = {"id": u.id, "email": u.email}
-except Exception:
-    pass
-
 if st.session_state.user is None:
     auth_screen()
 else: